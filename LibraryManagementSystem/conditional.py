@@ -0,0 +1,66 @@
+"""
+Conditional GET for DRF viewsets.
+
+The ETag of a GET is derived from the generation counters of the model
+families the viewset reads (see response_cache), so a matching
+If-None-Match is answered with 304 before the handler runs any query.
+The counters live in the cache, so ETags are only sent when the cache is
+shared by every worker: a per-process counter never sees the bumps made
+by other workers and would validate stale data forever.
+"""
+import hashlib
+import json
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .response_cache import cache_is_shared, generations, normalize_params
+
+
+class NotModified(APIException):
+    status_code = status.HTTP_304_NOT_MODIFIED
+
+
+class ConditionalGetMixin:
+    # model families whose changes alter this viewset's responses
+    etag_families = ()
+
+    def get_etag_families(self):
+        return self.etag_families
+
+    def get_etag_parts(self, request):
+        return [
+            self.basename,
+            self.action,
+            sorted(self.kwargs.items()),
+            normalize_params(request.query_params),
+            getattr(request, 'accepted_media_type', None),
+            generations(self.get_etag_families()),
+        ]
+
+    def initial(self, request, *args, **kwargs):
+        # authentication, permissions and content negotiation come first
+        super().initial(request, *args, **kwargs)
+
+        self.etag = None
+        if request.method not in ('GET', 'HEAD') or not cache_is_shared():
+            return
+
+        digest = hashlib.sha1(json.dumps(self.get_etag_parts(request), default=str).encode()).hexdigest()
+        self.etag = f'W/"{digest}"'
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        if self.etag in [tag.strip() for tag in if_none_match.split(',')]:
+            raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = self.etag
+        return response
@@ -0,0 +1,13 @@
+"""Query plan helpers for the index tests."""
+from django.db import connection
+
+
+def index_plan(queryset):
+    """
+    EXPLAIN with sequential scans disabled for the current transaction, so
+    the plan shows whether an index can serve the query even on the tiny
+    tables of a test.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+    return queryset.explain()
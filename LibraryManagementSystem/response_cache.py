@@ -0,0 +1,155 @@
+"""
+Response cache for the read-heavy catalogue endpoints.
+
+Cached responses are keyed by endpoint, normalized query params and the
+current generation of every model family they read. Writers bump a
+family's generation instead of deleting keys, so stale entries are never
+read again and age out of the cache on their own (LRU/TTL). Generations
+are only seen by every worker in a shared cache, so without one the
+views are not cached at all.
+"""
+import functools
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework.response import Response
+
+BOOKS = 'books'
+LIBRARIES = 'libraries'
+# loans, and the copy status and availability they change
+BORROWINGS = 'borrowings'
+
+
+def cache_is_shared():
+    """Whether the default cache is one store for every worker, not a per-process one"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def generation_key(family):
+    return f'generation:{family}'
+
+
+def new_generation():
+    # time based, so a generation lost from the cache is never handed out again
+    return time.time_ns() // 1000
+
+
+def generation(family):
+    key = generation_key(family)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, new_generation(), None)
+        value = cache.get(key)
+    return value
+
+
+def generations(families):
+    values = cache.get_many([generation_key(family) for family in families])
+    return [values.get(generation_key(family)) or generation(family) for family in families]
+
+
+def bump(*families):
+    """Invalidate everything cached for these families once the current transaction commits"""
+    def apply():
+        for family in families:
+            try:
+                cache.incr(generation_key(family))
+            except ValueError:
+                cache.set(generation_key(family), new_generation(), None)
+    transaction.on_commit(apply)
+
+
+def normalize_params(params):
+    """Sorted (name, values) pairs without empty values, so equal queries share a key"""
+    return sorted(
+        (name, sorted(value for value in params.getlist(name) if value != ''))
+        for name in params
+        if any(value != '' for value in params.getlist(name))
+    )
+
+
+def cache_key(name, params, families):
+    digest = hashlib.sha1(json.dumps(normalize_params(params)).encode()).hexdigest()
+    versions = '.'.join(str(version) for version in generations(families))
+    return f'response:{name}:{versions}:{digest}'
+
+
+def get_or_compute(key, compute, timeout=None):
+    """
+    Cached value of key, computing it at most once at a time: the first
+    miss takes a lock and computes, concurrent misses wait for its result
+    for up to RESPONSE_CACHE_LOCK_SECONDS, or until the lock is released
+    without one, before computing themselves.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    timeout = timeout or getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+    lock_seconds = getattr(settings, 'RESPONSE_CACHE_LOCK_SECONDS', 10)
+    lock = f'{key}:lock'
+
+    if cache.add(lock, 1, lock_seconds):
+        try:
+            value = compute()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock)
+        return value
+
+    deadline = time.monotonic() + lock_seconds
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        found = cache.get_many([key, lock])
+        if found.get(key) is not None:
+            return found[key]
+        if lock not in found:
+            # released without a value: the result wasn't cacheable or computing failed
+            break
+    return compute()
+
+
+def cached_response(*families, timeout=None):
+    """
+    Cache the data of a successful viewset action, keyed by its query
+    params and the generations of the given families. With a per-process
+    cache the action just runs.
+    """
+    def decorator(view_method):
+        name = view_method.__qualname__
+
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if not cache_is_shared():
+                # other workers would never see this worker's bumps
+                return view_method(self, request, *args, **kwargs)
+
+            errors = []
+
+            def compute():
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    errors.append(response)
+                    # nothing is cached for errors
+                    raise _Uncacheable
+                return response.data
+
+            key = cache_key(name, request.query_params, families)
+            try:
+                data = get_or_compute(key, compute, timeout)
+            except _Uncacheable:
+                return errors[0]
+            return Response(data)
+
+        return wrapper
+    return decorator
+
+
+class _Uncacheable(Exception):
+    pass
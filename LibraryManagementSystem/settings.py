@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'users',
@@ -64,7 +65,7 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
     ),
 }
 ROOT_URLCONF = 'LibraryManagementSystem.urls'
@@ -75,8 +76,15 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
             "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
+    'TOKEN_USER_CLASS': 'users.authentication.TokenUser',
 }
 
+# Full User rows behind token users are cached in-process for this long
+AUTH_USER_CACHE_TTL = 30
+# Token revocations are stored in users.RevokedToken/TokenRevocation and checked against an in-process copy
+# reloaded this often, so a revocation made by another worker can take this many seconds to apply
+AUTH_REVOCATION_REFRESH = 30
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -107,6 +115,7 @@ CORS_ALLOW_HEADERS = [
 ]
 
 WSGI_APPLICATION = 'LibraryManagementSystem.wsgi.application'
+ASGI_APPLICATION = 'LibraryManagementSystem.asgi.application'
 
 
 
@@ -124,6 +133,32 @@ DATABASES = {
       }
 }
 
+# Cache
+# locmem (per process, LRU) unless REDIS_URL points at a shared Redis;
+# run Redis with an LRU maxmemory-policy so stale responses are evicted
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+
+# Catalogue responses, see LibraryManagementSystem/response_cache.py
+RESPONSE_CACHE_TIMEOUT = 300
+RESPONSE_CACHE_LOCK_SECONDS = 10
+
+# books export: X-Export-Timestamp is set back this many seconds, see BookViewSet.export
+EXPORT_SINCE_OVERLAP = 300
+
 
 EMAIL_HOST = 'sandbox.smtp.mailtrap.io'
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
@@ -131,7 +166,45 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_PORT = '2525'
 EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False').lower() == 'true'
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'library@example.com')
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+
+# Outgoing mail is queued in notifications.OutboundEmail and sent by `manage.py send_outbox`
+EMAIL_OUTBOX_MAX_ATTEMPTS = 8
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = 30
+EMAIL_OUTBOX_RETRY_MAX_SECONDS = 3600
+EMAIL_OUTBOX_LEASE_SECONDS = 300
+
+# api/v1/notifications/stream/ is served under ASGI, e.g. `uvicorn LibraryManagementSystem.asgi:application`
+NOTIFICATION_STREAM_HEARTBEAT = 15
+NOTIFICATION_STREAM_MAX_AGE = 300
+
+
+# Password hashing
+# PASSWORD_HASHER picks how new hashes are made: argon2 (needs argon2-cffi),
+# bcrypt (needs bcrypt) or pbkdf2. The others stay listed so existing hashes
+# verify; they are rehashed at login. Measure costs with `manage.py benchmark_login`.
+
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv('PASSWORD_PBKDF2_ITERATIONS', 600000))
+PASSWORD_ARGON2_TIME_COST = int(os.getenv('PASSWORD_ARGON2_TIME_COST', 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv('PASSWORD_ARGON2_MEMORY_COST', 102400))
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv('PASSWORD_ARGON2_PARALLELISM', 8))
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv('PASSWORD_BCRYPT_ROUNDS', 12))
+
+_PASSWORD_HASHERS = {
+    'argon2': 'users.hashers.TunedArgon2PasswordHasher',
+    'bcrypt': 'users.hashers.TunedBCryptSHA256PasswordHasher',
+    'pbkdf2': 'users.hashers.TunedPBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
 
+# Concurrent password verifications of the async login (users.passwords), 0 runs each in its own thread
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -25,4 +25,5 @@ urlpatterns = [
     path('api/v1/libraries/', include('libraries.urls')),
     path('api/v1/authors/', include('authors.urls')),
     path('api/v1/borrowing/', include('borrowing.urls')),
+    path('api/v1/notifications/', include('notifications.urls')),
 ]
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from authors.models import AuthorBookCount
+from LibraryManagementSystem.response_cache import bump, BOOKS
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the author book-count rollup'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only compare the rollup with the catalogue and report drift',
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = AuthorBookCount.find_mismatches()
+            for (author_id, library_id, category_id), stored, actual in mismatches:
+                self.stdout.write(
+                    f'author {author_id} library {library_id or "all"} category {category_id or "all"}: '
+                    f'stored {stored}, actual {actual}'
+                )
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} author book counts are out of sync')
+            self.stdout.write(self.style.SUCCESS('Author book counts are in sync'))
+            return
+
+        rows = AuthorBookCount.rebuild()
+        # cached responses and ETags were computed from the old counts
+        bump(BOOKS)
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt {rows} author book counts')
+        )
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_book_updated_at'),
+        ('libraries', '0004_bookcopy_status_indexes'),
+        ('authors', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorBookCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book_count', models.PositiveIntegerField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='book_counts', to='authors.author')),
+                ('category', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='books.category')),
+                ('library', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='libraries.library')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['library', 'category', 'author'], name='author_count_lookup_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='authorbookcount',
+            constraint=models.UniqueConstraint(models.F('author'), django.db.models.functions.comparison.Coalesce('library', 0), django.db.models.functions.comparison.Coalesce('category', 0), name='unique_author_book_count'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO authors_authorbookcount (author_id, library_id, category_id, book_count)
+                SELECT ba.author_id, c.library_id, bc.category_id, COUNT(DISTINCT ba.book_id)
+                FROM books_book_authors ba
+                LEFT JOIN LATERAL (
+                    SELECT DISTINCT library_id FROM libraries_bookcopy WHERE book_id = ba.book_id
+                ) c ON true
+                LEFT JOIN books_book_categories bc ON bc.book_id = ba.book_id
+                GROUP BY GROUPING SETS (
+                    (ba.author_id),
+                    (ba.author_id, c.library_id),
+                    (ba.author_id, bc.category_id),
+                    (ba.author_id, c.library_id, bc.category_id)
+                )
+                HAVING (GROUPING(c.library_id) = 1 OR c.library_id IS NOT NULL)
+                   AND (GROUPING(bc.category_id) = 1 OR bc.category_id IS NOT NULL)
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
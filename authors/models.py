@@ -1,7 +1,11 @@
-from django.db import models
+import threading
+
+from django.db import models, connection, transaction
 from users.models import User
 # Create your models here.
-from django.db.models import Count, Q
+from django.db.models import Exists, OuterRef, Prefetch, Subquery, F
+from django.db.models.functions import Coalesce
+from django.apps import apps
 from django.core.paginator import Paginator
 
 
@@ -9,54 +13,45 @@ class Author(models.Model):
     user = models.OneToOneField(User, primary_key=True, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
 
+    MAX_RESULTS_PER_PAGE = 100
+
     def __str__(self):
         return self.name
 
     def get_book_count(self, library=None, category=None):
         """Get count of books by this author with optional filters"""
-        books = self.books.all()
-
-        if library:
-            books = books.filter(copies__library_id=library).distinct()
-
-        if category:
-            books = books.filter(categories__id=category).distinct()
-
-        return books.count()
+        count = AuthorBookCount.objects.filter(
+            author=self, **AuthorBookCount.key_filter(library, category)
+        ).values_list('book_count', flat=True).first()
+        return count or 0
 
     @staticmethod
     def list_authors_with_book_counts(library=None, category=None, page=1, results_per_page=10):
-        """List authors with book counts and optional filters"""
-        authors = Author.objects.annotate(
-            book_count=Count('books', distinct=True)
-        )
-
-        if library:
-            authors = authors.filter(books__copies__library_id=library).distinct()
-
-        if category:
-            authors = authors.filter(books__categories__id=category).distinct()
-
+        """List authors with book counts and optional filters, read from the AuthorBookCount rollup"""
         if library or category:
-            filter_condition = Q()
-            if library:
-                filter_condition &= Q(books__copies__library_id=library)
-            if category:
-                filter_condition &= Q(books__categories__id=category)
-
-            authors = authors.annotate(
-                filtered_book_count=Count('books', filter=filter_condition, distinct=True)
-            )
+            # only authors with matching books have a row
+            authors = AuthorBookCount.objects.filter(
+                **AuthorBookCount.key_filter(library, category)
+            ).select_related('author').order_by('author_id')
+        else:
+            authors = Author.objects.annotate(
+                book_count=Coalesce(Subquery(
+                    AuthorBookCount.objects.filter(
+                        author=OuterRef('pk'), **AuthorBookCount.key_filter()
+                    ).values('book_count')
+                ), 0)
+            ).order_by('pk')
 
         paginator = Paginator(authors, results_per_page)
         page_obj = paginator.get_page(page)
 
         author_list = []
-        for author in page_obj:
+        for row in page_obj:
+            author = row.author if library or category else row
             author_dict = {
                 "user": author.user_id,
                 "name": author.name,
-                "book_count": author.book_count if not (library or category) else author.filtered_book_count
+                "book_count": row.book_count
             }
             author_list.append(author_dict)
 
@@ -72,19 +67,26 @@ class Author(models.Model):
     @staticmethod
     def list_authors_with_books(category=None, library=None, page=1, results_per_page=10):
         """Get authors with all their books """
-        authors = Author.objects.prefetch_related(
-            'books',
-            'books__categories'
-        )
+        Book = apps.get_model('books', 'Book')
+        BookCopy = apps.get_model('libraries', 'BookCopy')
 
-        filters = Q()
+        # books matching the filters, with their categories, in one prefetch
+        books = Book.objects.order_by('pk')
         if category:
-            filters &= Q(books__categories__id=category)
+            books = books.filter(Exists(
+                Book.categories.through.objects.filter(book_id=OuterRef('pk'), category_id=category)
+            ))
         if library:
-            filters &= Q(books__copies__library_id=library)
+            books = books.filter(Exists(
+                BookCopy.objects.filter(book_id=OuterRef('pk'), library_id=library)
+            ))
 
-        if filters:
-            authors = authors.filter(filters).distinct()
+        authors = Author.objects.order_by('pk').prefetch_related(
+            Prefetch('books', queryset=books.prefetch_related('categories'), to_attr='filtered_books')
+        )
+
+        if category or library:
+            authors = authors.filter(Exists(books.filter(authors=OuterRef('pk'))))
 
         paginator = Paginator(authors, results_per_page)
         page_obj = paginator.get_page(page)
@@ -92,19 +94,17 @@ class Author(models.Model):
         result = []
         for author in page_obj:
             books_data = []
-            for book in author.books.all():
-                if (not category or book.categories.filter(id=category).exists()) and \
-                        (not library or book.copies.filter(library_id=library).exists()):
-                    books_data.append({
-                        "id": book.id,
-                        "title": book.title,
-                        "isbn": book.isbn,
-                        "publication_year": book.publication_year,
-                        "categories": [
-                            {"id": cat.id, "name": cat.name}
-                            for cat in book.categories.all()
-                        ]
-                    })
+            for book in author.filtered_books:
+                books_data.append({
+                    "id": book.id,
+                    "title": book.title,
+                    "isbn": book.isbn,
+                    "publication_year": book.publication_year,
+                    "categories": [
+                        {"id": cat.id, "name": cat.name}
+                        for cat in book.categories.all()
+                    ]
+                })
 
             result.append({
                 "id": author.user_id,
@@ -119,4 +119,149 @@ class Author(models.Model):
             "current_page": page_obj.number,
             "has_next": page_obj.has_next(),
             "has_previous": page_obj.has_previous(),
-        }
\ No newline at end of file
+        }
+
+
+# books whose authors AuthorBookCount.refresh_books_on_commit refreshes, per thread
+_pending_refresh = threading.local()
+
+
+class AuthorBookCount(models.Model):
+    """
+    Number of distinct books of an author, overall (library and category
+    NULL), per library holding a copy, per category and per library and
+    category. Only non-zero counts are stored. Kept up to date by
+    authors.signals, rebuilt by `manage.py rebuild_author_book_counts`.
+    """
+    author = models.ForeignKey(Author, on_delete=models.CASCADE, related_name='book_counts')
+    library = models.ForeignKey('libraries.Library', on_delete=models.CASCADE, null=True, related_name='+')
+    category = models.ForeignKey('books.Category', on_delete=models.CASCADE, null=True, related_name='+')
+    book_count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                F('author'), Coalesce('library', 0), Coalesce('category', 0),
+                name='unique_author_book_count'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['library', 'category', 'author'], name='author_count_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.author_id} library={self.library_id} category={self.category_id}: {self.book_count}"
+
+    @staticmethod
+    def key_filter(library=None, category=None):
+        """Filter kwargs for the rows of one (library, category) key, None meaning all"""
+        return {
+            **({'library_id': library} if library else {'library__isnull': True}),
+            **({'category_id': category} if category else {'category__isnull': True}),
+        }
+
+    @classmethod
+    def rollup_sql(cls, where=''):
+        """
+        SELECT of every (author, library, category, count) in one pass with GROUPING SETS.
+        A book without copies or categories joins a NULL library/category;
+        HAVING drops those groups so NULL only ever means 'all'.
+        """
+        Book = apps.get_model('books', 'Book')
+        BookCopy = apps.get_model('libraries', 'BookCopy')
+
+        return f"""
+            SELECT ba.author_id, c.library_id, bc.category_id, COUNT(DISTINCT ba.book_id)
+            FROM {connection.ops.quote_name(Book.authors.through._meta.db_table)} ba
+            LEFT JOIN LATERAL (
+                SELECT DISTINCT library_id
+                FROM {connection.ops.quote_name(BookCopy._meta.db_table)}
+                WHERE book_id = ba.book_id
+            ) c ON true
+            LEFT JOIN {connection.ops.quote_name(Book.categories.through._meta.db_table)} bc
+                ON bc.book_id = ba.book_id
+            {where}
+            GROUP BY GROUPING SETS (
+                (ba.author_id),
+                (ba.author_id, c.library_id),
+                (ba.author_id, bc.category_id),
+                (ba.author_id, c.library_id, bc.category_id)
+            )
+            HAVING (GROUPING(c.library_id) = 1 OR c.library_id IS NOT NULL)
+               AND (GROUPING(bc.category_id) = 1 OR bc.category_id IS NOT NULL)
+        """
+
+    @classmethod
+    def refresh(cls, author_ids):
+        """Recompute the counts of the given authors"""
+        author_ids = sorted(set(author_ids))
+        if not author_ids:
+            return
+
+        with transaction.atomic():
+            # serialize refreshes of the same author
+            list(Author.objects.select_for_update().filter(pk__in=author_ids).values_list('pk', flat=True))
+            cls.objects.filter(author_id__in=author_ids).delete()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {connection.ops.quote_name(cls._meta.db_table)} "
+                    f"(author_id, library_id, category_id, book_count) {cls.rollup_sql('WHERE ba.author_id = ANY(%s)')}",
+                    [author_ids]
+                )
+
+    @classmethod
+    def refresh_books_on_commit(cls, book_ids):
+        """
+        Refresh the authors of these books after the current transaction
+        commits, once for every book it touched: a library deleted with
+        thousands of copies costs one refresh, not one per copy.
+        """
+        pending = getattr(_pending_refresh, 'book_ids', None)
+        if pending is None:
+            pending = _pending_refresh.book_ids = set()
+        pending.update(book_ids)
+
+        def flush():
+            # the first callback of a transaction takes every pending book, the others find none
+            book_ids = set(pending)
+            pending.clear()
+            if book_ids:
+                cls.refresh(cls.authors_of_books(book_ids))
+        transaction.on_commit(flush)
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every count"""
+        table = connection.ops.quote_name(cls._meta.db_table)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE")
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(
+                f"INSERT INTO {table} (author_id, library_id, category_id, book_count) {cls.rollup_sql()}"
+            )
+            return cursor.rowcount
+
+    @classmethod
+    def find_mismatches(cls):
+        """((author_id, library_id, category_id), stored, actual) for every count that drifted"""
+        with connection.cursor() as cursor:
+            cursor.execute(cls.rollup_sql())
+            actual = {tuple(row[:3]): row[3] for row in cursor.fetchall()}
+        stored = {
+            (author_id, library_id, category_id): book_count
+            for author_id, library_id, category_id, book_count
+            in cls.objects.values_list('author_id', 'library_id', 'category_id', 'book_count')
+        }
+        return [
+            (key, stored.get(key, 0), actual.get(key, 0))
+            for key in sorted(stored.keys() | actual.keys(), key=lambda key: tuple(part or 0 for part in key))
+            if stored.get(key, 0) != actual.get(key, 0)
+        ]
+
+    @classmethod
+    def authors_of_books(cls, book_ids):
+        Book = apps.get_model('books', 'Book')
+        return set(
+            Book.authors.through.objects.filter(book_id__in=list(book_ids)).values_list('author_id', flat=True)
+        )
@@ -0,0 +1,68 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from books.models import Book, Category
+from libraries.models import BookCopy
+from .models import AuthorBookCount
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def book_authors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Books were linked to or unlinked from authors"""
+    if action == 'pre_clear':
+        if reverse:
+            instance._rollup_author_ids = {instance.pk}
+        else:
+            instance._rollup_author_ids = set(instance.authors.values_list('pk', flat=True))
+        return
+
+    if action == 'post_clear':
+        AuthorBookCount.refresh(instance._rollup_author_ids)
+    elif action in ('post_add', 'post_remove'):
+        AuthorBookCount.refresh({instance.pk} if reverse else pk_set or ())
+
+
+@receiver(m2m_changed, sender=Book.categories.through)
+def book_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Books were added to or removed from categories"""
+    if action == 'pre_clear':
+        book_ids = instance.books.values_list('pk', flat=True) if reverse else [instance.pk]
+        instance._rollup_author_ids = AuthorBookCount.authors_of_books(book_ids)
+        return
+
+    if action == 'post_clear':
+        AuthorBookCount.refresh(instance._rollup_author_ids)
+    elif action in ('post_add', 'post_remove'):
+        AuthorBookCount.refresh(AuthorBookCount.authors_of_books((pk_set or ()) if reverse else [instance.pk]))
+
+
+@receiver(pre_delete, sender=Book)
+@receiver(pre_delete, sender=Category)
+def catalogue_deleting(sender, instance, **kwargs):
+    """Their link rows are deleted without m2m_changed, remember whose counts change"""
+    book_ids = [instance.pk] if sender is Book else instance.books.values_list('pk', flat=True)
+    instance._rollup_author_ids = AuthorBookCount.authors_of_books(book_ids)
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Category)
+def catalogue_deleted(sender, instance, **kwargs):
+    AuthorBookCount.refresh(getattr(instance, '_rollup_author_ids', ()))
+
+
+@receiver(post_save, sender=BookCopy)
+def book_copy_saved(sender, instance, created, **kwargs):
+    """A copy appeared in a library or moved, status doesn't matter to the counts"""
+    previous, current = getattr(instance, '_stock_change', (None, instance.stock_state()))
+    if previous is not None and previous[:2] == current[:2]:
+        return
+    book_ids = {current[0]}
+    if previous is not None:
+        book_ids.add(previous[0])
+    AuthorBookCount.refresh_books_on_commit(book_ids)
+
+
+@receiver(post_delete, sender=BookCopy)
+def book_copy_deleted(sender, instance, **kwargs):
+    # a deleted book's own authors are refreshed by catalogue_deleted
+    AuthorBookCount.refresh_books_on_commit([instance.book_id])
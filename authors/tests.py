@@ -1,3 +1,78 @@
+from unittest import mock
+
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from books.models import Book, Category
+from libraries.models import Library, BookCopy
+from users.models import User
+from .models import Author, AuthorBookCount
+
+
+class AuthorsWithBooksQueryCountTests(TestCase):
+    def setUp(self):
+        self.library = Library.objects.create(name='Central', address='Main St')
+        self.category = Category.objects.create(name='Science Fiction')
+        for number in range(6):
+            user = User.objects.create(username=f'author{number}', email=f'author{number}@example.com')
+            author = Author.objects.create(user=user, name=f'Author {number}')
+            for item in range(number + 1):
+                book = Book.objects.create(
+                    isbn=f'978{number:05d}{item:05d}', title=f'Book {number}-{item}', publication_year=2000
+                )
+                book.authors.add(author)
+                book.categories.add(self.category)
+                BookCopy.objects.create(book=book, library=self.library, inventory_number=f'C-{number}-{item}')
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        # count, authors, their books, the books' categories
+        for results_per_page in (1, 3, 6):
+            with self.assertNumQueries(4):
+                result = Author.list_authors_with_books(results_per_page=results_per_page)
+            self.assertEqual(len(result['authors']), results_per_page)
+
+    def test_query_count_does_not_grow_with_filters(self):
+        for results_per_page in (1, 6):
+            with self.assertNumQueries(4):
+                result = Author.list_authors_with_books(
+                    category=self.category.pk, library=self.library.pk, results_per_page=results_per_page
+                )
+            self.assertEqual(len(result['authors']), results_per_page)
+
+
+class AuthorBookCountRefreshTests(TestCase):
+    def setUp(self):
+        self.library = Library.objects.create(name='Central', address='Main St')
+        user = User.objects.create(username='author', email='author@example.com')
+        self.author = Author.objects.create(user=user, name='Frank Herbert')
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(5):
+                book = Book.objects.create(isbn=f'97800000000{number:02d}', title=f'Book {number}',
+                                           publication_year=2000)
+                book.authors.add(self.author)
+                BookCopy.objects.create(book=book, library=self.library, inventory_number=f'C-{number}')
+
+    def test_copies_are_counted_once_committed(self):
+        self.assertEqual(self.author.get_book_count(library=self.library.pk), 5)
+
+    def test_deleting_a_library_refreshes_once(self):
+        library_id = self.library.pk
+        with mock.patch.object(AuthorBookCount, 'refresh', wraps=AuthorBookCount.refresh) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.library.delete()
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(self.author.get_book_count(library=library_id), 0)
+        self.assertEqual(AuthorBookCount.find_mismatches(), [])
+
 
-# Create your tests here.
+class ResultsPerPageTests(TestCase):
+    def test_results_per_page_is_clamped(self):
+        user = User.objects.create(username='author', email='author@example.com')
+        Author.objects.create(user=user, name='Frank Herbert')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        for endpoint in ('authors_with_book_counts', 'loaded_authors'):
+            for results_per_page in (0, -5, 10 ** 6):
+                response = client.get(f'/api/v1/authors/{endpoint}/', {'results_per_page': results_per_page})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['authors']), 1)
@@ -4,13 +4,17 @@ from .models import Author
 from .serializers import AuthorSerializer
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from LibraryManagementSystem.response_cache import cached_response, BOOKS
+from LibraryManagementSystem.conditional import ConditionalGetMixin
 
 
-class AuthorViewSet(viewsets.ModelViewSet):
+class AuthorViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Author.objects.all()
     serializer_class = AuthorSerializer
+    etag_families = (BOOKS,)
 
     @action(detail=False, methods=['get'])
+    @cached_response(BOOKS)
     def authors_with_book_counts(self, request):
         """List authors with their book counts with optional filters"""
         library = request.query_params.get('library')
@@ -25,6 +29,7 @@ class AuthorViewSet(viewsets.ModelViewSet):
             results_per_page = int(request.query_params.get('results_per_page', 10))
         except ValueError:
             results_per_page = 10
+        results_per_page = min(max(results_per_page, 1), Author.MAX_RESULTS_PER_PAGE)
 
         result = Author.list_authors_with_book_counts(
             library=library,
@@ -36,6 +41,7 @@ class AuthorViewSet(viewsets.ModelViewSet):
         return Response(result)
 
     @action(detail=False, methods=['get'])
+    @cached_response(BOOKS)
     def loaded_authors(self, request):
         """Get authors with all their books and categoriess"""
         category = request.query_params.get('category')
@@ -50,6 +56,7 @@ class AuthorViewSet(viewsets.ModelViewSet):
             results_per_page = int(request.query_params.get('results_per_page', 10))
         except ValueError:
             results_per_page = 10
+        results_per_page = min(max(results_per_page, 1), Author.MAX_RESULTS_PER_PAGE)
 
         result = Author.list_authors_with_books(
             category=category,
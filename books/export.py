@@ -0,0 +1,63 @@
+import json
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef, Prefetch, Q
+
+from authors.models import Author
+from .models import Book, Category
+
+
+def iter_catalogue(since=None, chunk_size=2000):
+    """
+    Yield one dict per book with its authors, categories and per-library
+    copy counts. Books are read through a server-side cursor and the
+    related rows are prefetched per chunk, so memory stays flat.
+    With since, only books changed (or whose copy counts changed) at or
+    after that time are included; deleted books leave no trace, only a
+    full export drops them.
+    """
+    BookAvailability = apps.get_model('libraries', 'BookAvailability')
+
+    books = Book.objects.defer('search_vector').order_by('pk').prefetch_related(
+        Prefetch('authors', queryset=Author.objects.order_by('pk')),
+        Prefetch('categories', queryset=Category.objects.order_by('pk')),
+        Prefetch('availability', queryset=BookAvailability.objects.order_by('library_id')),
+    )
+
+    if since is not None:
+        books = books.filter(
+            Q(updated_at__gte=since)
+            | Exists(BookAvailability.objects.filter(book_id=OuterRef('pk'), updated_at__gte=since))
+        )
+
+    for book in books.iterator(chunk_size=chunk_size):
+        yield {
+            "id": book.id,
+            "isbn": book.isbn,
+            "title": book.title,
+            "publication_year": book.publication_year,
+            "updated_at": book.updated_at,
+            "authors": [
+                {"id": author.user_id, "name": author.name}
+                for author in book.authors.all()
+            ],
+            "categories": [
+                {"id": category.id, "name": category.name}
+                for category in book.categories.all()
+            ],
+            "copies": [
+                {
+                    "library_id": counter.library_id,
+                    "available": counter.available_count,
+                    "borrowed": counter.borrowed_count,
+                }
+                for counter in book.availability.all()
+            ],
+        }
+
+
+def iter_ndjson(records):
+    """Encode records as newline-delimited JSON"""
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,298 @@
+import csv
+import json
+from itertools import islice
+
+from django.apps import apps
+from django.db import DatabaseError, transaction
+
+from authors.models import Author, AuthorBookCount
+from LibraryManagementSystem.response_cache import bump, BOOKS
+from .models import Book, Category
+
+# largest value of an integer column
+MAX_INTEGER = 2 ** 31 - 1
+
+
+class MalformedRow:
+    """Stands in for an NDJSON line that isn't valid JSON, validate_row reports it"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def read_rows(stream, file_format):
+    """
+    Yield rows from a CSV (header: isbn,title,publication_year,authors,
+    categories,library,inventory_number,status) or NDJSON text stream.
+    authors and categories are ';'-separated names in CSV and may be lists
+    in NDJSON. A malformed NDJSON line is yielded as a MalformedRow, so the
+    rest of the file is still imported.
+    """
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+    elif file_format == 'ndjson':
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield MalformedRow(f"malformed JSON: {e}")
+    else:
+        raise ValueError(f"Unsupported format {file_format}, use csv or ndjson")
+
+
+def split_names(value, field, max_length):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(';')
+    elif not isinstance(value, list):
+        raise ValueError(f"{field} must be a string or a list")
+    names = []
+    for name in value:
+        name = text(name, field, max_length, required=False)
+        if name:
+            names.append(name)
+    return names
+
+
+def text(value, field, max_length, required=True):
+    """value as a stripped string that fits a column of max_length"""
+    if value is None:
+        value = ''
+    if not isinstance(value, (str, int)) or isinstance(value, bool):
+        raise ValueError(f"{field} must be a string")
+    value = str(value).strip()
+    if required and not value:
+        raise ValueError(f"{field} is required")
+    if len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def validate_row(row, line):
+    """
+    The normalized entry for one row, or ValueError if a value would not
+    fit the database, so one bad row can't fail the whole chunk.
+    """
+    BookCopy = apps.get_model('libraries', 'BookCopy')
+
+    if isinstance(row, MalformedRow):
+        raise ValueError(row.error)
+    if not isinstance(row, dict):
+        raise ValueError("row must be an object")
+    for field in ("isbn", "title", "publication_year"):
+        if field not in row:
+            raise ValueError(f"{field} is required")
+
+    try:
+        publication_year = int(row["publication_year"])
+    except (TypeError, ValueError):
+        raise ValueError("publication_year must be an integer")
+    if not 0 <= publication_year <= MAX_INTEGER:
+        raise ValueError(f"publication_year must be between 0 and {MAX_INTEGER}")
+
+    try:
+        library = int(row["library"]) if row.get("library") else None
+    except (TypeError, ValueError):
+        raise ValueError("library must be an integer")
+    if library is not None and not 0 < library <= MAX_INTEGER:
+        raise ValueError(f"library must be between 1 and {MAX_INTEGER}")
+
+    status = row.get("status") or 'available'
+    if not isinstance(status, str) or status not in dict(BookCopy.STATUS_CHOICES):
+        raise ValueError(f"Invalid status {status}")
+
+    return {
+        "line": line,
+        "isbn": text(row["isbn"], "isbn", Book._meta.get_field('isbn').max_length),
+        "title": text(row["title"], "title", Book._meta.get_field('title').max_length),
+        "publication_year": publication_year,
+        "authors": split_names(row.get("authors"), "authors", Author._meta.get_field('name').max_length),
+        "categories": split_names(row.get("categories"), "categories", Category._meta.get_field('name').max_length),
+        "library": library,
+        "inventory_number": text(
+            row.get("inventory_number"), "inventory_number",
+            BookCopy._meta.get_field('inventory_number').max_length, required=False
+        ),
+        "status": status,
+    }
+
+
+def import_catalogue(rows, chunk_size=1000, progress=None):
+    """
+    Import books, categories, author links and copies in chunks of
+    chunk_size rows, each chunk in its own transaction with a fixed number
+    of queries. Authors must already exist and are matched by name.
+    progress(report) is called after every chunk. A chunk the database
+    rejects is rolled back and reported as an error, the other chunks are
+    still imported. A stream that stops decoding ends the import with the
+    rows read so far imported and the rest reported as one error.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+
+    report = {
+        "rows": 0,
+        "books_created": 0,
+        "books_updated": 0,
+        "categories_created": 0,
+        "copies_created": 0,
+        "copies_skipped": 0,
+        "errors": [],
+    }
+
+    rows = iter(rows)
+    line = 0
+    decode_error = None
+    while decode_error is None:
+        chunk = []
+        try:
+            chunk.extend(islice(rows, chunk_size))
+        except UnicodeDecodeError as e:
+            # the text stream can't be read past this point
+            decode_error = e
+        if not chunk:
+            break
+
+        # counted apart so a rolled back chunk adds nothing to the report
+        chunk_report = {name: 0 if name != "errors" else [] for name in report}
+        try:
+            with transaction.atomic():
+                import_chunk(chunk, line, chunk_report)
+                bump(BOOKS)
+        except DatabaseError as e:
+            report["errors"].append({
+                "line": line + 1,
+                "error": f"Rows {line + 1}-{line + len(chunk)} were not imported: {e}"
+            })
+        else:
+            for name, value in chunk_report.items():
+                report[name] += value
+
+        line += len(chunk)
+        report["rows"] = line
+        if progress:
+            progress(report)
+
+    if decode_error is not None:
+        report["errors"].append({
+            "line": line + 1,
+            "error": f"Rows from {line + 1} on were not imported, the file is not valid UTF-8: {decode_error}"
+        })
+    return report
+
+
+def import_chunk(chunk, first_line, report):
+    Library = apps.get_model('libraries', 'Library')
+    BookCopy = apps.get_model('libraries', 'BookCopy')
+    BookAvailability = apps.get_model('libraries', 'BookAvailability')
+
+    # validate and normalize
+    entries = []
+    for offset, row in enumerate(chunk):
+        line = first_line + offset + 1
+        try:
+            entries.append(validate_row(row, line))
+        except ValueError as e:
+            report["errors"].append({"line": line, "error": f"Invalid row: {e}"})
+
+    # resolve authors by name in one query
+    author_names = {name for entry in entries for name in entry["authors"]}
+    authors_by_name = {}
+    for author_id, name in Author.objects.filter(name__in=author_names).order_by('pk').values_list('pk', 'name'):
+        authors_by_name.setdefault(name, author_id)
+
+    libraries = set(
+        Library.objects.filter(id__in={entry["library"] for entry in entries if entry["library"]})
+        .values_list('id', flat=True)
+    )
+
+    valid = []
+    for entry in entries:
+        unknown = [name for name in entry["authors"] if name not in authors_by_name]
+        if unknown:
+            report["errors"].append({"line": entry["line"], "error": f"Unknown authors: {', '.join(unknown)}"})
+        elif entry["library"] and entry["library"] not in libraries:
+            report["errors"].append({"line": entry["line"], "error": f"Unknown library {entry['library']}"})
+        else:
+            valid.append(entry)
+    if not valid:
+        return
+
+    # categories: create the missing ones, then resolve all in one query
+    category_names = {name for entry in valid for name in entry["categories"]}
+    existing_categories = set(Category.objects.filter(name__in=category_names).values_list('name', flat=True))
+    Category.objects.bulk_create(
+        [Category(name=name) for name in category_names - existing_categories],
+        ignore_conflicts=True
+    )
+    report["categories_created"] += len(category_names - existing_categories)
+    categories_by_name = dict(Category.objects.filter(name__in=category_names).values_list('name', 'id'))
+
+    # books: one upsert keyed on isbn, the last row for an isbn wins
+    books_by_isbn = {entry["isbn"]: entry for entry in valid}
+    existing_isbns = set(Book.objects.filter(isbn__in=books_by_isbn).values_list('isbn', flat=True))
+    Book.objects.bulk_create(
+        [
+            Book(isbn=isbn, title=entry["title"], publication_year=entry["publication_year"])
+            for isbn, entry in books_by_isbn.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['isbn'],
+        update_fields=['title', 'publication_year', 'updated_at']
+    )
+    report["books_created"] += len(books_by_isbn) - len(existing_isbns)
+    report["books_updated"] += len(existing_isbns)
+    book_ids = dict(Book.objects.filter(isbn__in=books_by_isbn).values_list('isbn', 'id'))
+
+    # m2m links straight into the through tables
+    Book.authors.through.objects.bulk_create(
+        {
+            (book_ids[entry["isbn"]], authors_by_name[name]): Book.authors.through(
+                book_id=book_ids[entry["isbn"]], author_id=authors_by_name[name]
+            )
+            for entry in valid for name in entry["authors"]
+        }.values(),
+        ignore_conflicts=True
+    )
+    Book.categories.through.objects.bulk_create(
+        {
+            (book_ids[entry["isbn"]], categories_by_name[name]): Book.categories.through(
+                book_id=book_ids[entry["isbn"]], category_id=categories_by_name[name]
+            )
+            for entry in valid for name in entry["categories"]
+        }.values(),
+        ignore_conflicts=True
+    )
+
+    # copies: skip inventory numbers the library already has
+    copy_entries = {
+        (entry["library"], entry["inventory_number"]): entry
+        for entry in valid if entry["library"] and entry["inventory_number"]
+    }
+    existing_copies = set(
+        BookCopy.objects.filter(
+            library_id__in={library for library, _ in copy_entries},
+            inventory_number__in={number for _, number in copy_entries}
+        ).values_list('library_id', 'inventory_number')
+    )
+    new_copies = [
+        BookCopy(
+            book_id=book_ids[entry["isbn"]],
+            library_id=library,
+            inventory_number=inventory_number,
+            status=entry["status"]
+        )
+        for (library, inventory_number), entry in copy_entries.items()
+        if (library, inventory_number) not in existing_copies
+    ]
+    BookCopy.objects.bulk_create(new_copies)
+    BookAvailability.apply_deltas(BookAvailability.moves(
+        (None, copy.stock_state()) for copy in new_copies
+    ))
+    report["copies_created"] += len(new_copies)
+    report["copies_skipped"] += len(copy_entries) - len(new_copies)
+
+    Book.refresh_search_vectors(book_ids.values())
+    AuthorBookCount.refresh(AuthorBookCount.authors_of_books(book_ids.values()))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from books.export import iter_catalogue, iter_ndjson
+
+
+class Command(BaseCommand):
+    help = 'Export the book catalogue as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='Only export books changed at or after this ISO 8601 timestamp',
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write to (defaults to stdout)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows fetched per round trip',
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('--since must be an ISO 8601 timestamp')
+
+        lines = iter_ndjson(iter_catalogue(since=since, chunk_size=options['chunk_size']))
+
+        if options['output']:
+            count = 0
+            with open(options['output'], 'w') as output:
+                for line in lines:
+                    output.write(line)
+                    count += 1
+            self.stdout.write(
+                self.style.SUCCESS(f'Successfully exported {count} books')
+            )
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
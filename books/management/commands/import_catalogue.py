@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from books.importer import read_rows, import_catalogue
+
+
+class Command(BaseCommand):
+    help = 'Bulk import books, categories, author links and copies from CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or NDJSON file')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'ndjson'],
+            help='File format (defaults to the file extension)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Rows imported per transaction',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+
+        def progress(report):
+            self.stdout.write(
+                f"{report['rows']} rows: {report['books_created']} books created, "
+                f"{report['books_updated']} updated, {report['copies_created']} copies created, "
+                f"{len(report['errors'])} errors"
+            )
+
+        try:
+            with open(path, newline='', encoding='utf-8') as stream:
+                report = import_catalogue(
+                    read_rows(stream, file_format),
+                    chunk_size=options['chunk_size'],
+                    progress=progress
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Successfully imported {report['rows']} rows")
+        )
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:41
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE books_book b SET search_vector =
+                    setweight(to_tsvector('english', coalesce(b.title, '') || ' ' || coalesce(b.isbn, '')), 'A')
+                    || setweight(to_tsvector('english', coalesce((
+                        SELECT string_agg(a.name, ' ')
+                        FROM books_book_authors ba
+                        JOIN authors_author a ON a.user_id = ba.author_id
+                        WHERE ba.book_id = b.id
+                    ), '')), 'B')
+                    || setweight(to_tsvector('english', coalesce((
+                        SELECT string_agg(c.name, ' ')
+                        FROM books_book_categories bc
+                        JOIN books_category c ON c.id = bc.category_id
+                        WHERE bc.book_id = b.id
+                    ), '')), 'C')
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -3,8 +3,15 @@ from django.db import models
 from authors.models import Author
 from django.core.validators import MinValueValidator
 from django.core.paginator import Paginator
-from django.db.models import Q
-from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Exists, OuterRef, Subquery, F, Sum
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField, SearchQuery, SearchRank
+from django.apps import apps
+from django.utils import timezone
+import json
 
 
 class Category(models.Model):
@@ -20,40 +27,117 @@ class Book(models.Model):
     authors = models.ManyToManyField(Author, related_name='books')
     publication_year = models.IntegerField(validators=[MinValueValidator(0)])
     categories = models.ManyToManyField(Category, related_name="books")
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    SEARCH_CONFIG = 'english'
+    MAX_RESULTS_PER_PAGE = 100
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='book_search_vector_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
     def is_available_in_library(self, library_id):
         """Check if book is available in specific library"""
-        return self.copies.filter(
+        return self.availability.filter(
             library_id=library_id,
-            status='available'
+            available_count__gt=0
         ).exists()
 
     def get_available_copies_count(self, library_id=None):
         """Count available copies with or without library"""
-        copies = self.copies.filter(status='available')
+        counters = self.availability.all()
         if library_id:
-            copies = copies.filter(library_id=library_id)
-        return copies.count()
-
-
-    def list_books(self, category=None, author=None, library=None, page=1, results_per_page=10):
-        """query with optional filters and pagination"""
-        books = Book.objects.prefetch_related('authors','categories','copies').values('id','title').annotate(authors=ArrayAgg('authors__name'),
-        categories=ArrayAgg('categories__name'))
-
-        filters = Q()
+            counters = counters.filter(library_id=library_id)
+        return counters.aggregate(total=Coalesce(Sum('available_count'), 0))['total']
+
+    def get_availability_by_library(self):
+        """Available copy count per library id, for libraries that have any"""
+        return dict(
+            self.availability.filter(available_count__gt=0).values_list('library_id', 'available_count')
+        )
+
+
+    @classmethod
+    def list_books(cls, category=None, author=None, library=None, page=1, results_per_page=10,
+                   cursor=None, approximate_total=False):
+        """
+        query with optional filters and pagination.
+        Pass the previous response's next_cursor as cursor for keyset
+        pagination on id, which stays fast however deep the page is.
+        """
+        BookCopy = apps.get_model('libraries', 'BookCopy')
+
+        books = cls.objects.all()
         if category:
-            filters &= Q(categories__name=category)
+            books = books.filter(Exists(
+                cls.categories.through.objects.filter(book_id=OuterRef('pk'), category__name=category)
+            ))
         if author:
-            filters &= Q(authors__name=author)
+            books = books.filter(Exists(
+                cls.authors.through.objects.filter(book_id=OuterRef('pk'), author__name=author)
+            ))
         if library:
-            filters &= Q(copies__library_id=library)
+            books = books.filter(Exists(
+                BookCopy.objects.filter(book_id=OuterRef('pk'), library_id=library)
+            ))
+
+        if approximate_total:
+            total_books = cls.estimate_count(books)
+        elif cursor is None:
+            total_books = books.count()
+        else:
+            total_books = None
+
+        # correlated array subqueries only run for the rows of the page
+        rows = cls.with_names(books.order_by('id').values('id', 'title'))
+
+        if cursor is not None:
+            rows = list(rows.filter(id__gt=cursor)[:results_per_page + 1])
+            has_next = len(rows) > results_per_page
+            rows = rows[:results_per_page]
+            return {
+                "books": rows,
+                "total_books": total_books,
+                "next_cursor": rows[-1]['id'] if has_next else None,
+                "has_next": has_next,
+            }
+
+        total_pages = max((total_books + results_per_page - 1) // results_per_page, 1)
+        page = max(page, 1)
+        if not approximate_total:
+            # an estimate can be too low, the page asked for is served and has_next tells where it ends
+            page = min(page, total_pages)
+        start = (page - 1) * results_per_page
+        rows = list(rows[start:start + results_per_page + 1])
+        has_next = len(rows) > results_per_page
+        rows = rows[:results_per_page]
+        if rows:
+            total_pages = max(total_pages, page + has_next)
 
-        filtered_books = books.filter(filters).distinct()
-        paginator = Paginator(filtered_books, results_per_page)
+        return {
+            "books": rows,
+            "total_books": total_books,
+            "total_pages": total_pages,
+            "current_page": page,
+            "has_next": has_next,
+            "has_previous": page > 1,
+            "next_cursor": rows[-1]['id'] if has_next else None,
+        }
+
+    @classmethod
+    def search_books(cls, query, page=1, results_per_page=10):
+        """Ranked full-text search over title, ISBN, author and category names"""
+        search_query = SearchQuery(query, search_type='websearch', config=cls.SEARCH_CONFIG)
+        books = cls.objects.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', 'id')
+
+        paginator = Paginator(cls.with_names(books.values('id', 'title', 'isbn', 'rank')), results_per_page)
         page_object = paginator.get_page(page)
 
         return {
@@ -65,6 +149,47 @@ class Book(models.Model):
             "has_previous": page_object.has_previous(),
         }
 
+    @classmethod
+    def refresh_search_vectors(cls, book_ids):
+        """
+        Rebuild the denormalized search_vector of the given books in one
+        UPDATE. Also bumps updated_at, since author/category changes don't
+        go through Book.save.
+        """
+        author_names = cls.authors.through.objects.filter(book_id=OuterRef('pk')).values(
+            'book_id'
+        ).annotate(names=StringAgg('author__name', ' ')).values('names')
+        category_names = cls.categories.through.objects.filter(book_id=OuterRef('pk')).values(
+            'book_id'
+        ).annotate(names=StringAgg('category__name', ' ')).values('names')
+
+        return cls.objects.filter(pk__in=book_ids).update(
+            search_vector=(
+                SearchVector('title', 'isbn', weight='A', config=cls.SEARCH_CONFIG)
+                + SearchVector(Subquery(author_names), weight='B', config=cls.SEARCH_CONFIG)
+                + SearchVector(Subquery(category_names), weight='C', config=cls.SEARCH_CONFIG)
+            ),
+            updated_at=timezone.now()
+        )
+
+    @staticmethod
+    def with_names(rows):
+        """Add author and category name arrays to a values() queryset of books"""
+        return rows.annotate(
+            authors=ArraySubquery(
+                Author.objects.filter(books=OuterRef('pk')).order_by('pk').values('name')
+            ),
+            categories=ArraySubquery(
+                Category.objects.filter(books=OuterRef('pk')).order_by('pk').values('name')
+            ),
+        )
+
+    @staticmethod
+    def estimate_count(queryset):
+        """Row estimate from the PostgreSQL planner instead of a COUNT(*)"""
+        plan = json.loads(queryset.explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+
     def get_author_names(self):
         """Return author's names"""
         return list(self.authors.values_list('name', flat=True))
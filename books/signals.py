@@ -0,0 +1,52 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from authors.models import Author
+from LibraryManagementSystem.response_cache import bump, BOOKS
+from .models import Book, Category
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, update_fields=None, **kwargs):
+    """Keep the search vector in sync with title and ISBN"""
+    bump(BOOKS)
+    if update_fields and not {'title', 'isbn'} & set(update_fields):
+        return
+    Book.refresh_search_vectors([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+@receiver(m2m_changed, sender=Book.categories.through)
+def book_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Author or category links were added, removed or cleared"""
+    if reverse and action == 'pre_clear':
+        # remember which books lose the link, they are gone after the clear
+        instance._cleared_book_ids = list(instance.books.values_list('pk', flat=True))
+        return
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    bump(BOOKS)
+
+    if not reverse:
+        Book.refresh_search_vectors([instance.pk])
+    elif action == 'post_clear':
+        Book.refresh_search_vectors(instance._cleared_book_ids)
+    elif pk_set:
+        Book.refresh_search_vectors(pk_set)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Category)
+def name_changed(sender, instance, created, **kwargs):
+    """Author and category names are part of their books' search vectors"""
+    bump(BOOKS)
+    if not created:
+        Book.refresh_search_vectors(instance.books.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Category)
+def catalogue_deleted(sender, instance, **kwargs):
+    bump(BOOKS)
@@ -1,3 +1,279 @@
+import io
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from LibraryManagementSystem.response_cache import get_or_compute
+from users.models import User
+
+from . import importer
+from authors.models import Author
+from .models import Book, Category
+
+
+class ImportCatalogueTests(TestCase):
+    def test_rows_that_do_not_fit_the_columns_are_reported(self):
+        rows = [
+            {"isbn": "97800000000001234", "title": "Too long isbn", "publication_year": 2000},
+            {"isbn": "9780000000002", "title": "t" * 101, "publication_year": 2000},
+            {"isbn": "9780000000003", "title": "Negative year", "publication_year": -1},
+            {"isbn": "9780000000004", "title": "List status", "publication_year": 2000, "status": ["lost"]},
+            {"isbn": "9780000000005", "title": "Dune", "publication_year": 1965},
+        ]
+        report = importer.import_catalogue(rows)
+
+        self.assertEqual(report["books_created"], 1)
+        self.assertEqual([error["line"] for error in report["errors"]], [1, 2, 3, 4])
+        self.assertEqual(list(Book.objects.values_list('isbn', flat=True)), ["9780000000005"])
+
+    def test_failed_chunk_is_reported_and_not_counted(self):
+        import_chunk = importer.import_chunk
+
+        def fail_first_chunk(chunk, first_line, report):
+            import_chunk(chunk, first_line, report)
+            if first_line == 0:
+                raise DatabaseError("value too long")
+
+        rows = [
+            {"isbn": f"978000000000{number}", "title": f"Book {number}", "publication_year": 2000}
+            for number in range(4)
+        ]
+        with mock.patch.object(importer, 'import_chunk', fail_first_chunk):
+            report = importer.import_catalogue(rows, chunk_size=2)
+
+        self.assertEqual(report["rows"], 4)
+        self.assertEqual(report["books_created"], 2)
+        self.assertEqual(report["errors"][0]["line"], 1)
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_malformed_ndjson_lines_are_reported(self):
+        stream = io.StringIO(
+            '{"isbn": "9780000000001", "title": "Dune", "publication_year": 1965}\n'
+            '{"isbn": "9780000000002", "title": \n'
+            '{"isbn": "9780000000003", "title": "Emma", "publication_year": 1815}\n'
+        )
+        report = importer.import_catalogue(importer.read_rows(stream, 'ndjson'), chunk_size=1)
+
+        self.assertEqual(report["rows"], 3)
+        self.assertEqual(report["books_created"], 2)
+        self.assertEqual([error["line"] for error in report["errors"]], [2])
+        self.assertIn("malformed JSON", report["errors"][0]["error"])
+
+
+    def test_chunk_size_below_one_is_rejected(self):
+        rows = [{"isbn": "9780000000001", "title": "Dune", "publication_year": 1965}]
+        for chunk_size in (0, -1):
+            with self.assertRaises(ValueError):
+                importer.import_catalogue(rows, chunk_size=chunk_size)
+            with self.assertRaises(CommandError):
+                call_command('import_catalogue', 'catalogue.ndjson', chunk_size=chunk_size)
+
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create(username='admin', email='admin@example.com', role='admin'))
+        upload = SimpleUploadedFile('catalogue.ndjson', b'{"isbn": "9780000000001", "title": "Dune", '
+                                                        b'"publication_year": 1965}\n')
+        response = client.post('/api/v1/books/books/bulk_import/', {"file": upload, "chunk_size": 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Book.objects.exists())
+
+    def test_undecodable_upload_returns_the_partial_report(self):
+        lines = [b'isbn,title,publication_year'] + [
+            f'978{number:010d},Book {number},2000'.encode() for number in range(400)
+        ]
+        upload = SimpleUploadedFile('catalogue.csv', b'\n'.join(lines) + b'\n978\xff,Bad,2000\n')
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create(username='admin', email='admin@example.com', role='admin'))
+
+        response = client.post('/api/v1/books/books/bulk_import/', {"file": upload, "chunk_size": 50})
+
+        self.assertEqual(response.status_code, 200)
+        # the rows decoded before the bad block are committed and counted
+        error, = response.data["errors"]
+        self.assertIn("not valid UTF-8", error["error"])
+        self.assertGreater(response.data["books_created"], 50)
+        self.assertEqual(response.data["books_created"], error["line"] - 1)
+        self.assertEqual(Book.objects.count(), response.data["books_created"])
+
+
+class ListBooksTests(TestCase):
+    def setUp(self):
+        Book.objects.bulk_create([
+            Book(isbn=f'97800000000{number:02d}', title=f'Book {number}', publication_year=2000)
+            for number in range(25)
+        ])
+        self.ids = list(Book.objects.order_by('id').values_list('id', flat=True))
+
+    def test_keyset_pages_cover_every_book_once(self):
+        ids = []
+        cursor = 0
+        while cursor is not None:
+            result = Book.list_books(cursor=cursor, results_per_page=10)
+            ids += [book['id'] for book in result['books']]
+            cursor = result['next_cursor']
+        self.assertEqual(ids, self.ids)
+
+    def test_approximate_total_serves_the_page_asked_for(self):
+        # the planner estimate can be far too low
+        with mock.patch.object(Book, 'estimate_count', return_value=1):
+            result = Book.list_books(page=3, results_per_page=10, approximate_total=True)
+        self.assertEqual([book['id'] for book in result['books']], self.ids[20:])
+        self.assertEqual((result['current_page'], result['total_pages'], result['has_next']), (3, 3, False))
+
+        with mock.patch.object(Book, 'estimate_count', return_value=1):
+            result = Book.list_books(page=2, results_per_page=10, approximate_total=True)
+        self.assertEqual([book['id'] for book in result['books']], self.ids[10:20])
+        self.assertEqual((result['current_page'], result['total_pages'], result['has_next']), (2, 3, True))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.herbert = Author.objects.create(
+            user=User.objects.create(username='fherbert', email='fherbert@example.com'), name='Frank Herbert'
+        )
+        self.austen = Author.objects.create(
+            user=User.objects.create(username='jausten', email='jausten@example.com'), name='Jane Austen'
+        )
+        self.saga = Category.objects.create(name='Desert Saga')
+        self.dune = Book.objects.create(isbn='9780441013593', title='Dune', publication_year=1965)
+        self.dune.authors.add(self.herbert)
+        self.memoir = Book.objects.create(isbn='9780000000002', title='Remembering Herbert', publication_year=2003)
+        self.arrakis = Book.objects.create(isbn='9780000000003', title='Arrakis', publication_year=2000)
+        self.arrakis.categories.add(self.saga)
+
+    @staticmethod
+    def titles(query):
+        return [book['title'] for book in Book.search_books(query)['books']]
+
+    def test_title_ranks_above_author_and_category(self):
+        # title and ISBN weigh A, author names B, category names C
+        self.assertEqual(self.titles('herbert'), ['Remembering Herbert', 'Dune'])
+        self.dune.title = 'Desert Planet'
+        self.dune.save()
+        self.assertEqual(self.titles('desert'), ['Desert Planet', 'Arrakis'])
+
+    def test_isbn_matches(self):
+        self.assertEqual(self.titles('9780441013593'), ['Dune'])
+
+    def test_results_carry_rank_and_names(self):
+        book, = Book.search_books('dune')['books']
+        self.assertEqual((book['authors'], book['categories']), (['Frank Herbert'], []))
+        self.assertGreater(book['rank'], 0)
+
+    def test_renamed_author_and_category(self):
+        self.herbert.name = 'Brian Herbert'
+        self.herbert.save()
+        self.assertEqual(self.titles('brian'), ['Dune'])
+        self.assertEqual(self.titles('frank'), [])
+
+        self.saga.name = 'Spice Chronicles'
+        self.saga.save()
+        self.assertEqual(self.titles('spice'), ['Arrakis'])
+        self.assertEqual(self.titles('desert'), [])
+
+    def test_forward_links(self):
+        self.dune.authors.add(self.austen)
+        self.assertEqual(self.titles('austen'), ['Dune'])
+        self.dune.authors.remove(self.austen)
+        self.assertEqual(self.titles('austen'), [])
+        self.dune.categories.add(self.saga)
+        self.dune.categories.clear()
+        self.assertEqual(self.titles('desert'), ['Arrakis'])
+
+    def test_reverse_links(self):
+        self.austen.books.add(self.dune, self.arrakis)
+        self.assertEqual(self.titles('austen'), ['Dune', 'Arrakis'])
+        self.austen.books.remove(self.arrakis)
+        self.assertEqual(self.titles('austen'), ['Dune'])
+        self.austen.books.clear()
+        self.assertEqual(self.titles('austen'), [])
+
+        self.saga.books.add(self.memoir)
+        # equal ranks come in id order
+        self.assertEqual(self.titles('desert'), ['Remembering Herbert', 'Arrakis'])
+        self.saga.books.clear()
+        self.assertEqual(self.titles('desert'), [])
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create(username='reader', email='reader@example.com'))
+        response = client.get('/api/v1/books/books/search/', {'q': 'dune'})
+        self.assertEqual([book['title'] for book in response.data['books']], ['Dune'])
+        self.assertEqual(client.get('/api/v1/books/books/search/', {'q': ' '}).status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+    url = '/api/v1/books/books/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create(username='reader', email='reader@example.com'))
+
+    def test_no_etag_without_a_shared_cache(self):
+        # the test settings use the per-process LocMemCache
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_matching_etag_is_not_modified_with_a_shared_cache(self):
+        with mock.patch('LibraryManagementSystem.conditional.cache_is_shared', return_value=True):
+            etag = self.client.get(self.url)['ETag']
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class ExportTests(TestCase):
+    url = '/api/v1/books/books/export/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create(username='reader', email='reader@example.com'))
+        Book.objects.create(isbn='9780000000001', title='Dune', publication_year=1965)
+
+    def test_export_timestamp_round_trips_as_since(self):
+        timestamp = self.client.get(self.url)['X-Export-Timestamp']
+        self.assertTrue(timestamp.endswith('Z'))
+
+        # set back by the overlap, so the book written just now is sent again
+        response = self.client.get(self.url, {'since': timestamp})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 1)
+
+
+class ResponseCacheTests(TestCase):
+    url = '/api/v1/books/books/list_books/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create(username='reader', email='reader@example.com'))
+        self.book = Book.objects.create(isbn='9780000000001', title='Dune', publication_year=1965)
+
+    def titles(self):
+        return [book["title"] for book in self.client.get(self.url).data["books"]]
+
+    def test_not_cached_without_a_shared_cache(self):
+        self.assertEqual(self.titles(), ['Dune'])
+        # written without a bump, as another worker's bump would be unseen here
+        Book.objects.filter(pk=self.book.pk).update(title='Dune Messiah')
+        self.assertEqual(self.titles(), ['Dune Messiah'])
+
+    def test_cached_with_a_shared_cache(self):
+        with mock.patch('LibraryManagementSystem.response_cache.cache_is_shared', return_value=True):
+            self.assertEqual(self.titles(), ['Dune'])
+            Book.objects.filter(pk=self.book.pk).update(title='Dune Messiah')
+            self.assertEqual(self.titles(), ['Dune'])
+
+    def test_waiters_stop_when_the_lock_is_released_without_a_value(self):
+        cache.add('response:test:lock', 1, 10)
+        threading.Timer(0.1, cache.delete, ['response:test:lock']).start()
 
-# Create your tests here.
+        started = time.monotonic()
+        self.assertEqual(get_or_compute('response:test', lambda: 'computed'), 'computed')
+        self.assertLess(time.monotonic() - started, 5)
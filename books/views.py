@@ -1,54 +1,178 @@
 from django.shortcuts import render
-from rest_framework import viewsets
+from rest_framework import viewsets, status
 from .models import Book, Category
 from .serializers import BookSerializer, CategorySerializer
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.parsers import MultiPartParser
+from users.permissions import IsAdmin
+from LibraryManagementSystem.response_cache import cached_response, BOOKS, BORROWINGS
+from LibraryManagementSystem.conditional import ConditionalGetMixin
+from .export import iter_catalogue, iter_ndjson
+from .importer import read_rows, import_catalogue
+import io
+from datetime import timedelta, timezone as dt_timezone
 
 
 #test
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
+    etag_families = (BOOKS,)
+
+    def get_etag_families(self):
+        # both emit availability counts, which move with every loan
+        if self.action in ('availability', 'export'):
+            return (BOOKS, BORROWINGS)
+        return self.etag_families
 
     @action(methods=['get'], detail=False)
+    @cached_response(BOOKS)
     def list_books(self, request):
         category = request.query_params.get('category')
         author = request.query_params.get('author')
         library = request.query_params.get('library')
-        page = int(request.query_params.get('page', 1))
+        approximate_total = request.query_params.get('approximate_total', '').lower() in ('1', 'true')
+
+        try:
+            page = int(request.query_params.get('page', 1))
+        except ValueError:
+            page = 1
+
+        try:
+            results_per_page = int(request.query_params.get('results_per_page', 10))
+        except ValueError:
+            results_per_page = 10
+        results_per_page = min(max(results_per_page, 1), Book.MAX_RESULTS_PER_PAGE)
 
-        result = Book().list_books(
+        try:
+            cursor = int(request.query_params['cursor'])
+        except (KeyError, ValueError):
+            cursor = None
+
+        result = Book.list_books(
             category=category,
             author=author,
             library=library,
-            page=page
+            page=page,
+            results_per_page=results_per_page,
+            cursor=cursor,
+            approximate_total=approximate_total
         )
 
         return Response(result)
 
+    @action(methods=['post'], detail=False, permission_classes=[IsAdmin], parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        """Import a CSV or NDJSON catalogue file (see books.importer.read_rows)"""
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response(
+                {"error": "A 'file' upload is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        file_format = request.data.get('format') or ('csv' if upload.name.endswith('.csv') else 'ndjson')
+
+        try:
+            chunk_size = int(request.data.get('chunk_size') or 1000)
+        except ValueError:
+            chunk_size = 0
+        if chunk_size < 1:
+            return Response(
+                {"error": "chunk_size must be an integer of at least 1"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            report = import_catalogue(
+                read_rows(io.TextIOWrapper(upload.file, encoding='utf-8', newline=''), file_format),
+                chunk_size=chunk_size
+            )
+        except ValueError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(report)
+
+    @action(methods=['get'], detail=False)
+    def export(self, request):
+        """
+        Stream the whole catalogue as NDJSON. Pass the X-Export-Timestamp of
+        the previous export as since= to only get what changed after it.
+
+        The timestamp is EXPORT_SINCE_OVERLAP seconds before the export
+        started, so rows written by transactions still open at that time
+        are sent again by the next export rather than missed: clients
+        upsert by id. Deleted books are never in an incremental export;
+        run a full export to drop them.
+        """
+        since = None
+        if request.query_params.get('since'):
+            since = parse_datetime(request.query_params['since'])
+            if since is None:
+                return Response(
+                    {"error": "since must be an ISO 8601 timestamp, e.g. 2024-01-31T12:00:00Z"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        overlap = timedelta(seconds=getattr(settings, 'EXPORT_SINCE_OVERLAP', 300))
+        export_timestamp = timezone.now().astimezone(dt_timezone.utc) - overlap
+        response = StreamingHttpResponse(
+            iter_ndjson(iter_catalogue(since=since)),
+            content_type='application/x-ndjson'
+        )
+        # Z instead of +00:00, which turns into a space unless the client encodes it
+        response['X-Export-Timestamp'] = export_timestamp.isoformat().replace('+00:00', 'Z')
+        return response
+
+    @action(methods=['get'], detail=False)
+    def search(self, request):
+        """Ranked full-text search over the catalogue"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {"error": "Search query 'q' is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            page = int(request.query_params.get('page', 1))
+        except ValueError:
+            page = 1
+
+        try:
+            results_per_page = int(request.query_params.get('results_per_page', 10))
+        except ValueError:
+            results_per_page = 10
+        results_per_page = min(max(results_per_page, 1), Book.MAX_RESULTS_PER_PAGE)
+
+        result = Book.search_books(query, page=page, results_per_page=results_per_page)
+
+        return Response(result)
+
     @action(detail=True, methods=['get'])
-    def availability(self, request):
+    def availability(self, request, pk=None):
         book = self.get_object()
         library_id = request.query_params.get('library')
 
         if library_id:
-            is_available = book.is_available_in_library(library_id)
             available_copies = book.get_available_copies_count(library_id)
 
             return Response({
-                'is_available': is_available,
+                'is_available': available_copies > 0,
                 'available_copies': available_copies,
                 'library_id': library_id
             })
         else:
-            libraries = {}
-            for copy in book.copies.filter(status='available'):
-                library_id = copy.library_id
-                if library_id not in libraries:
-                    libraries[library_id] = 0
-                libraries[library_id] += 1
+            libraries = book.get_availability_by_library()
 
             return Response({
                 'availability_by_library': libraries,
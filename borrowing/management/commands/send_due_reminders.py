@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from borrowing.reminders import send_due_reminders
+
+
+class Command(BaseCommand):
+    help = 'Queue reminders for books due in the next 3 days, delivered by send_outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Users queued per transaction',
+        )
+
+    def handle(self, *args, **options):
+        totals = send_due_reminders(batch_size=options['batch_size'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully queued {totals['users']} reminders for {totals['items']} books"
+            )
+        )
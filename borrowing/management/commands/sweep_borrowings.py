@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from borrowing.services import sweep_borrowings
+
+
+class Command(BaseCommand):
+    help = 'Mark overdue borrowings and recompute their penalties'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of borrowings updated per statement',
+        )
+
+    def handle(self, *args, **options):
+        touched = sweep_borrowings(chunk_size=options['chunk_size'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully updated {touched} borrowings')
+        )
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrowing', '0002_borrowing_total_penalty'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='borroweditem',
+            index=models.Index(condition=models.Q(('returned_date__isnull', True)), fields=['due_date'], name='item_open_due_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borroweditem',
+            index=models.Index(condition=models.Q(('returned_date__isnull', True)), fields=['borrowing'], name='item_open_borrowing_idx'),
+        ),
+    ]
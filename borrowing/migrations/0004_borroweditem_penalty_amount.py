@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrowing', '0003_borroweditem_open_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='borroweditem',
+            name='penalty_amount',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=10),
+        ),
+    ]
@@ -1,13 +1,19 @@
 from django.db import models
 
-from django.db import models
+from django.db import models, transaction
 from users.models import User
-from libraries.models import BookCopy
+from libraries.models import BookCopy, BookAvailability
 from django.utils import timezone
 from datetime import timedelta
 from django.core.exceptions import ValidationError
-from django.core.mail import send_mail
+from notifications.outbox import queue_email
+from LibraryManagementSystem.response_cache import bump, BORROWINGS
 from django.conf import settings
+from django.db.models import Q, F, Count, Sum, Case, When, Value, ExpressionWrapper
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from decimal import Decimal
 
 
 
@@ -24,6 +30,8 @@ class Borrowing(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     total_penalty = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
 
+    DAILY_PENALTY_RATE = Decimal('1.00')
+
     def calculate_penalties(self):
         """Calculate penalties for overdue items"""
         penalty_amount = 0
@@ -58,6 +66,90 @@ class Borrowing(models.Model):
 
         self.save()
 
+    def return_items(self, item_ids, returned_date=None):
+        """
+        Return several items at once: one UPDATE for the items, one for
+        their copies, one counter upsert and a single write of the borrowing.
+        Raises BorrowedItem.DoesNotExist if an id isn't part of this borrowing.
+        """
+        returned_date = returned_date or timezone.now()
+
+        with transaction.atomic():
+            items = list(
+                self.items.select_for_update(of=('self',)).filter(id__in=item_ids).values_list(
+                    'id', 'due_date', 'returned_date', 'book_copy_id',
+                    'book_copy__book_id', 'book_copy__library_id', 'book_copy__status'
+                )
+            )
+
+            found = {item[0] for item in items}
+            for item_id in item_ids:
+                if item_id not in found:
+                    raise BorrowedItem.DoesNotExist(f"Borrowed item with ID {item_id} not found")
+
+            open_items = [item for item in items if item[2] is None]
+            if open_items:
+                penalties = [
+                    When(id=item_id, then=Value(self.late_return_penalty(due_date, returned_date)))
+                    for item_id, due_date, *_ in open_items
+                ]
+                BorrowedItem.objects.filter(id__in=[item[0] for item in open_items]).update(
+                    returned_date=returned_date,
+                    penalty_amount=Case(*penalties, default=Value(Decimal('0.00')),
+                                        output_field=models.DecimalField(max_digits=10, decimal_places=2))
+                )
+
+                BookCopy.objects.filter(id__in=[item[3] for item in open_items]).update(status='available')
+                BookAvailability.apply_deltas(BookAvailability.moves(
+                    ((book_id, library_id, copy_status), (book_id, library_id, 'available'))
+                    for _, _, _, _, book_id, library_id, copy_status in open_items
+                ))
+                bump(BORROWINGS)
+
+            self.refresh_totals()
+
+    def late_return_penalty(self, due_date, returned_date):
+        """Penalty for an item returned at returned_date"""
+        if returned_date <= due_date:
+            return Decimal('0.00')
+        return (returned_date.date() - due_date.date()).days * self.DAILY_PENALTY_RATE
+
+    def refresh_totals(self, now=None):
+        """
+        Recompute status and total_penalty from the items with one aggregate
+        query and save them with a single UPDATE. Same rules as
+        update_status and calculate_penalties.
+        """
+        now = now or timezone.now()
+        open_items = Q(returned_date__isnull=True)
+        overdue_open_items = open_items & Q(due_date__lt=now)
+
+        totals = self.items.aggregate(
+            item_count=Count('id'),
+            open_count=Count('id', filter=open_items),
+            overdue_count=Count('id', filter=overdue_open_items | Q(returned_date__gt=F('due_date'))),
+            overdue_time=Sum(
+                ExpressionWrapper(
+                    Value(now.date(), output_field=models.DateField()) - TruncDate('due_date'),
+                    output_field=models.DurationField()
+                ),
+                filter=overdue_open_items
+            ),
+        )
+        if not totals['item_count']:
+            return
+
+        if not totals['open_count']:
+            self.status = 'returned'
+        elif totals['overdue_count']:
+            self.status = 'overdue'
+        else:
+            self.status = 'active'
+
+        overdue_days = totals['overdue_time'].days if totals['overdue_time'] else 0
+        self.total_penalty = overdue_days * self.DAILY_PENALTY_RATE
+        self.save(update_fields=['status', 'total_penalty'])
+
     @staticmethod
     def can_borrow_more(user):
         """Check if user can borrow more books (limit of 3 books)"""
@@ -77,6 +169,16 @@ class BorrowedItem(models.Model):
     book_copy = models.ForeignKey(BookCopy, on_delete=models.CASCADE, related_name='borrow_records')
     due_date = models.DateTimeField()
     returned_date = models.DateTimeField(null=True, blank=True)
+    penalty_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+
+    class Meta:
+        indexes = [
+            # open loans: reminder/overdue scans by due date and per-borrowing limit checks
+            models.Index(fields=['due_date'], condition=Q(returned_date__isnull=True),
+                         name='item_open_due_date_idx'),
+            models.Index(fields=['borrowing'], condition=Q(returned_date__isnull=True),
+                         name='item_open_borrowing_idx'),
+        ]
 
     def __str__(self):
         return f"{self.book_copy.book.title} due on {self.due_date.strftime('%Y-%m-%d')}"
@@ -97,11 +199,13 @@ class BorrowedItem(models.Model):
                 DAILY_PENALTY_RATE = 1.00
                 self.penalty_amount = days_overdue * DAILY_PENALTY_RATE
 
-        self.book_copy.save()
-        super().save(*args, **kwargs)
+        # copy status, availability counters and the item change together
+        with transaction.atomic():
+            self.book_copy.save()
+            super().save(*args, **kwargs)
 
-        # then update status
-        self.borrowing.update_status()
+            # then update status
+            self.borrowing.update_status()
 
     def is_overdue(self):
         """Check if the item is overdue"""
@@ -117,6 +221,17 @@ class BorrowedItem(models.Model):
         return (self.due_date.date() - timezone.now().date()).days
 
 
+class JobCheckpoint(models.Model):
+    """Primary-key cursor of a batch job run, so a restarted run resumes where it stopped"""
+    name = models.CharField(max_length=100, unique=True)
+    cursor = models.BigIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at {self.cursor}"
+
+
 def send_borrow_confirmation_email(borrowing):
     """Send a confirmation email when books are borrowed"""
     subject = 'Books borrowed successfully'
@@ -140,29 +255,8 @@ def send_borrow_confirmation_email(borrowing):
     from_email = settings.DEFAULT_FROM_EMAIL
     recipient_list = [borrowing.user.email]
 
-    # In development, this will be captured by Mailhog
-    send_mail(subject, message, from_email, recipient_list, fail_silently=False)
-
-
-def send_due_date_reminder(borrowed_item):
-    """Send a reminder when a book is due soon"""
-    subject = 'Reminder: Book due date approaching'
-    message = f"""
-    Dear {borrowed_item.borrowing.user.username},
-
-    This is a reminder that your borrowed book "{borrowed_item.book_copy.book.title}" 
-    is due in {borrowed_item.days_until_due()} days on {borrowed_item.due_date.strftime('%Y-%m-%d')}.
-
-    Please return it on time to avoid penalty fees.
-
-    Thank you for using our library system!
-    """
-
-    from_email = settings.DEFAULT_FROM_EMAIL
-    recipient_list = [borrowed_item.borrowing.user.email]
-
-    # In development, this will be captured by Mailhog
-    send_mail(subject, message, from_email, recipient_list, fail_silently=False)
+    # Delivered by the send_outbox worker once the transaction commits
+    queue_email(subject, message, recipient_list, from_email=from_email)
 
 
 # Signal handlers
@@ -170,3 +264,12 @@ def borrowing_post_save(sender, instance, created, **kwargs):
     """Send confirmation email when a new borrowing is created"""
     if created:
         send_borrow_confirmation_email(instance)
+
+
+@receiver(post_save, sender=Borrowing)
+@receiver(post_delete, sender=Borrowing)
+@receiver(post_save, sender=BorrowedItem)
+@receiver(post_delete, sender=BorrowedItem)
+def loan_changed(sender, instance, **kwargs):
+    """Borrowing responses and their ETags are versioned by the borrowings generation"""
+    bump(BORROWINGS)
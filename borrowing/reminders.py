@@ -1,27 +1,140 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
 from datetime import timedelta
-from borrowing.models import BorrowedItem, send_due_date_reminder
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from notifications.models import Notification
+from notifications.outbox import queue_messages
+from .models import BorrowedItem, JobCheckpoint
+
+
+def due_soon_items(now, days=3):
+    """Open items due within the next `days` days, grouped by user"""
+    return BorrowedItem.objects.filter(
+        returned_date__isnull=True,
+        due_date__gte=now,
+        due_date__lte=now + timedelta(days=days)
+    ).select_related('borrowing__user', 'book_copy__book').order_by('borrowing__user_id', 'due_date', 'pk')
+
+
+def build_digest(user, items):
+    """One reminder email listing every book the user has due soon"""
+    books_list = '\n'.join(
+        f'    - "{item.book_copy.book.title}" due in {item.days_until_due()} days '
+        f'on {item.due_date.strftime("%Y-%m-%d")}'
+        for item in items
+    )
+
+    message = f"""
+    Dear {user.username},
+
+    This is a reminder that the following borrowed books are due soon:
 
+{books_list}
 
-class Command(BaseCommand):
-    help = 'Send reminders for books due in the next 3 days'
+    Please return them on time to avoid penalty fees.
 
-    def handle(self, *args, **options):
-        now = timezone.now()
-        three_days_later = now + timedelta(days=3)
+    Thank you for using our library system!
+    """
 
-        due_soon_items = BorrowedItem.objects.filter(
-            returned_date__isnull=True,
-            due_date__gte=now,
-            due_date__lte=three_days_later
+    return EmailMessage(
+        'Reminder: Book due date approaching',
+        message,
+        settings.DEFAULT_FROM_EMAIL,
+        [user.email]
+    )
+
+
+def iter_digests(items, chunk_size=2000):
+    """Stream (user, items) groups from an item queryset ordered by user"""
+    for _, user_items in groupby(items.iterator(chunk_size=chunk_size), key=lambda item: item.borrowing.user_id):
+        user_items = list(user_items)
+        yield user_items[0].borrowing.user, user_items
+
+
+def send_due_reminders(now=None, days=3, batch_size=100):
+    """
+    Queue one digest per user in the email outbox for the books they have
+    due in the next `days` days; the send_outbox worker delivers them over
+    reused connections and retries failures. Every reminded item is
+    recorded as a due_soon Notification (unique per item and due date), so
+    items that were already reminded are skipped. Each batch of users is
+    queued, recorded and checkpointed by user id in one transaction, so a
+    run that crashed resumes after the last batch without duplicates.
+    Overlapping runs take turns on the checkpoint row for each batch and
+    drop the items the other run reminded meanwhile. Returns the number
+    of users and items reminded.
+    """
+    now = now or timezone.now()
+    totals = {'users': 0, 'items': 0}
+
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=f'due_reminders:{now.date().isoformat()}')
+    if checkpoint.completed:
+        # a finished run is repeated from the start, the ledger skips what was sent
+        checkpoint.cursor = 0
+        checkpoint.completed = False
+        checkpoint.save(update_fields=['cursor', 'completed', 'updated_at'])
+
+    items = due_soon_items(now, days).filter(
+        borrowing__user_id__gt=checkpoint.cursor
+    ).exclude(Exists(
+        Notification.objects.filter(
+            borrowed_item=OuterRef('pk'),
+            notification_type='due_soon',
+            due_date=OuterRef('due_date')
         )
+    ))
+
+    def record(batch):
+        last_user_id = batch[-1][0].pk
+        with transaction.atomic():
+            locked = JobCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+            # read after the lock, so it includes what an overlapping run just committed
+            reminded = set(Notification.objects.filter(
+                borrowed_item__in=[item for _, user_items in batch for item in user_items],
+                notification_type='due_soon'
+            ).values_list('borrowed_item_id', 'due_date'))
+            batch = [
+                (user, [item for item in user_items if (item.pk, item.due_date) not in reminded])
+                for user, user_items in batch
+            ]
+            batch = [(user, user_items) for user, user_items in batch if user_items]
+            batch_items = [item for _, user_items in batch for item in user_items]
+
+            queue_messages(build_digest(user, user_items) for user, user_items in batch)
+            Notification.bulk_notify(
+                [
+                    Notification(
+                        user_id=item.borrowing.user_id,
+                        message=f'"{item.book_copy.book.title}" is due on {item.due_date.strftime("%Y-%m-%d")}',
+                        notification_type='due_soon',
+                        book_copy_id=item.book_copy_id,
+                        borrowed_item=item,
+                        due_date=item.due_date
+                    )
+                    for item in batch_items
+                ],
+                ignore_conflicts=True
+            )
+            checkpoint.cursor = max(locked.cursor, last_user_id)
+            checkpoint.save(update_fields=['cursor', 'updated_at'])
+
+        totals['users'] += len(batch)
+        totals['items'] += len(batch_items)
 
-        count = 0
-        for item in due_soon_items:
-            send_due_date_reminder(item)
-            count += 1
+    batch = []
+    for user, user_items in iter_digests(items):
+        batch.append((user, user_items))
+        if len(batch) >= batch_size:
+            record(batch)
+            batch = []
+    if batch:
+        record(batch)
 
-        self.stdout.write(
-            self.style.SUCCESS(f'Successfully sent {count} reminders')
-        )
\ No newline at end of file
+    checkpoint.completed = True
+    checkpoint.save(update_fields=['completed', 'updated_at'])
+    return totals
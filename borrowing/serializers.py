@@ -1,11 +1,12 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
+from authors.models import Author
 from .models import Borrowing, BorrowedItem
-from books.serializers import BookSerializer
 
 
 class BorrowedItemSerializer(serializers.ModelSerializer):
     book_title = serializers.ReadOnlyField(source='book_copy.book.title')
-    book_author = serializers.ReadOnlyField(source='book_copy.book.authors.first.name')
+    book_author = serializers.SerializerMethodField()
     is_overdue = serializers.SerializerMethodField()
     days_until_due = serializers.SerializerMethodField()
 
@@ -16,6 +17,25 @@ class BorrowedItemSerializer(serializers.ModelSerializer):
             'due_date', 'returned_date', 'penalty_amount', 'is_overdue', 'days_until_due'
         ]
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Load everything the serializer reads in a fixed number of queries"""
+        return queryset.select_related('book_copy__book').prefetch_related(
+            Prefetch(
+                'book_copy__book__authors',
+                queryset=Author.objects.order_by('pk')[:1],
+                to_attr='first_authors'
+            )
+        )
+
+    def get_book_author(self, obj):
+        book = obj.book_copy.book
+        if hasattr(book, 'first_authors'):
+            author = book.first_authors[0] if book.first_authors else None
+        else:
+            author = book.authors.first()
+        return author.name if author else None
+
     def get_is_overdue(self, obj):
         return obj.is_overdue()
 
@@ -34,6 +54,13 @@ class BorrowingSerializer(serializers.ModelSerializer):
             'status', 'total_penalty', 'items'
         ]
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Load the user and the nested items in a fixed number of queries"""
+        return queryset.select_related('user').prefetch_related(
+            Prefetch('items', queryset=BorrowedItemSerializer.setup_eager_loading(BorrowedItem.objects.all()))
+        )
+
 
 class BorrowingCreateSerializer(serializers.ModelSerializer):
     book_copies = serializers.ListField(
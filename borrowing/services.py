@@ -0,0 +1,76 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from LibraryManagementSystem.response_cache import bump, BORROWINGS
+from .models import Borrowing, BorrowedItem
+
+
+SWEEP_SQL = """
+    WITH totals AS (
+        SELECT item.borrowing_id,
+               COUNT(*) FILTER (WHERE item.returned_date IS NULL) AS open_count,
+               COUNT(*) FILTER (
+                   WHERE (item.returned_date IS NULL AND item.due_date < %(now)s)
+                      OR item.returned_date > item.due_date
+               ) AS overdue_count,
+               COALESCE(SUM(
+                   (%(now)s AT TIME ZONE %(tz)s)::date - (item.due_date AT TIME ZONE %(tz)s)::date
+               ) FILTER (WHERE item.returned_date IS NULL AND item.due_date < %(now)s), 0) AS overdue_days
+        FROM {items} item
+        WHERE item.borrowing_id = ANY(%(ids)s)
+        GROUP BY item.borrowing_id
+    ), computed AS (
+        SELECT borrowing_id,
+               CASE
+                   WHEN open_count = 0 THEN 'returned'
+                   WHEN overdue_count > 0 THEN 'overdue'
+                   ELSE 'active'
+               END AS status,
+               overdue_days * %(rate)s AS total_penalty
+        FROM totals
+    )
+    UPDATE {borrowings} borrowing
+    SET status = computed.status, total_penalty = computed.total_penalty
+    FROM computed
+    WHERE borrowing.id = computed.borrowing_id
+      AND (borrowing.status <> computed.status OR borrowing.total_penalty <> computed.total_penalty)
+"""
+
+
+def sweep_borrowings(chunk_size=1000, now=None):
+    """
+    Recompute status and total_penalty of every borrowing that isn't
+    returned yet, chunk_size borrowings per UPDATE. Rows that already hold
+    the right values are left alone, so running it again is a no-op.
+    Returns the number of borrowings that changed.
+    """
+    now = now or timezone.now()
+    sql = SWEEP_SQL.format(
+        items=connection.ops.quote_name(BorrowedItem._meta.db_table),
+        borrowings=connection.ops.quote_name(Borrowing._meta.db_table),
+    )
+
+    touched = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Borrowing.objects.exclude(status='returned').filter(id__gt=last_id)
+            .order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, {
+                'ids': ids,
+                'now': now,
+                'tz': timezone.get_current_timezone_name(),
+                'rate': Borrowing.DAILY_PENALTY_RATE,
+            })
+            touched += cursor.rowcount
+            if cursor.rowcount:
+                bump(BORROWINGS)
+
+        last_id = ids[-1]
+
+    return touched
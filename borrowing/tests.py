@@ -1,3 +1,307 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authors.models import Author
+from books.models import Book
+from libraries.models import Library, BookCopy, BookAvailability
+from LibraryManagementSystem.query_plans import index_plan
+from notifications.models import OutboundEmail
+from users.models import User
+from .models import Borrowing, BorrowedItem
+from . import reminders
+from .reminders import due_soon_items, send_due_reminders
+from .services import sweep_borrowings
+
+
+class BorrowedItemIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        library = Library.objects.create(name='Central', address='Main St')
+        book = Book.objects.create(isbn='9780000000001', title='Dune', publication_year=1965)
+        copy = BookCopy.objects.create(book=book, library=library, inventory_number='C-1')
+        self.borrowing = Borrowing.objects.create(user=self.user)
+        BorrowedItem.objects.bulk_create([
+            BorrowedItem(borrowing=self.borrowing, book_copy=copy, due_date=timezone.now() + timedelta(days=2))
+        ])
+
+    def test_due_date_scan_uses_open_due_date_index(self):
+        self.assertIn('item_open_due_date_idx', index_plan(due_soon_items(timezone.now())))
+
+    def test_open_items_of_a_borrowing_use_open_borrowing_index(self):
+        items = BorrowedItem.objects.filter(borrowing=self.borrowing, returned_date__isnull=True)
+        self.assertIn('item_open_borrowing_idx', index_plan(items))
+
+    def test_open_loan_count_per_user_uses_open_borrowing_index(self):
+        items = BorrowedItem.objects.filter(borrowing__user_id=self.user.pk, returned_date__isnull=True)
+        self.assertIn('item_open_borrowing_idx', index_plan(items))
+
+
+class BorrowingQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        self.library = Library.objects.create(name='Central', address='Main St')
+        writer = User.objects.create(username='fherbert', email='fherbert@example.com')
+        self.author = Author.objects.create(user=writer, name='Frank Herbert')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def add_borrowings(self, count, items_per_borrowing=2):
+        offset = Borrowing.objects.count()
+        for number in range(offset, offset + count):
+            borrowing = Borrowing.objects.create(user=self.user)
+            for item in range(items_per_borrowing):
+                book = Book.objects.create(
+                    isbn=f'978{number:05d}{item:05d}', title=f'Book {number}-{item}', publication_year=2000
+                )
+                book.authors.add(self.author)
+                copy = BookCopy.objects.create(
+                    book=book, library=self.library, inventory_number=f'C-{number}-{item}', status='borrowed'
+                )
+                BorrowedItem.objects.create(
+                    borrowing=borrowing, book_copy=copy, due_date=timezone.now() + timedelta(days=7)
+                )
+        return borrowing
+
+    def test_list_query_count_does_not_grow_with_borrowings(self):
+        # borrowings with their user, items with their copy and book, first authors
+        self.add_borrowings(1)
+        with self.assertNumQueries(3):
+            self.assertEqual(len(self.client.get('/api/v1/borrowing/borrowings/').data), 1)
+        self.add_borrowings(5, items_per_borrowing=3)
+        with self.assertNumQueries(3):
+            self.assertEqual(len(self.client.get('/api/v1/borrowing/borrowings/').data), 6)
+
+    def test_detail_query_count_does_not_grow_with_items(self):
+        small = self.add_borrowings(1)
+        large = self.add_borrowings(1, items_per_borrowing=5)
+        for borrowing in (small, large):
+            with self.assertNumQueries(3):
+                response = self.client.get(f'/api/v1/borrowing/borrowings/{borrowing.pk}/')
+            self.assertEqual(response.status_code, 200)
+
+    def test_active_borrowings_query_count_does_not_grow_with_borrowings(self):
+        self.add_borrowings(1)
+        with self.assertNumQueries(3):
+            self.client.get('/api/v1/borrowing/borrowings/active_borrowings/')
+        self.add_borrowings(4, items_per_borrowing=3)
+        with self.assertNumQueries(3):
+            self.assertEqual(len(self.client.get('/api/v1/borrowing/borrowings/active_borrowings/').data), 5)
+
+
+class BorrowBooksTests(TestCase):
+    url = '/api/v1/borrowing/borrowings/borrow_books/'
+
+    def setUp(self):
+        library = Library.objects.create(name='Central', address='Main St')
+        self.copies = []
+        for number in range(4):
+            book = Book.objects.create(isbn=f'97800000000{number:02d}', title=f'Book {number}', publication_year=2000)
+            self.copies.append(BookCopy.objects.create(book=book, library=library, inventory_number=f'C-{number}'))
+
+    def client_for(self, username):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create(username=username, email=f'{username}@example.com'))
+        return client
+
+    def borrow(self, client, copies, due_date=None):
+        due_date = due_date or timezone.localdate() + timedelta(days=7)
+        return client.post(self.url, {"book_copies": [copy.pk for copy in copies], "due_date": str(due_date)},
+                           format='json')
+
+    def test_query_count_does_not_grow_with_copies(self):
+        # user lock, limit count, copy lock, borrowing, items, copy update, counter upsert,
+        # the savepoint pair, and the response's borrowing, items and authors
+        for client, copies in ((self.client_for('one'), self.copies[:1]), (self.client_for('three'), self.copies[1:])):
+            with self.assertNumQueries(12):
+                self.assertEqual(self.borrow(client, copies).status_code, 201)
+
+    def test_past_due_date_is_overdue_at_once(self):
+        response = self.borrow(self.client_for('late'), self.copies[:1], due_date=timezone.localdate() - timedelta(days=1))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Borrowing.objects.get(pk=response.data['id']).status, 'overdue')
+
+
+class ReturnBooksTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        self.library = Library.objects.create(name='Central', address='Main St')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def lend(self, *due_in_days):
+        """A borrowing with one item per due date, days from now"""
+        borrowing = Borrowing.objects.create(user=self.user)
+        offset = BookCopy.objects.count()
+        for number, days in enumerate(due_in_days, offset):
+            book = Book.objects.create(isbn=f'97800000000{number:02d}', title=f'Book {number}', publication_year=2000)
+            copy = BookCopy.objects.create(book=book, library=self.library, inventory_number=f'C-{number}',
+                                           status='borrowed')
+            BorrowedItem.objects.bulk_create([
+                BorrowedItem(borrowing=borrowing, book_copy=copy, due_date=timezone.now() + timedelta(days=days))
+            ])
+        return borrowing
+
+    def return_items(self, borrowing, items):
+        return self.client.post(f'/api/v1/borrowing/borrowings/{borrowing.pk}/return_books/',
+                                {"item_ids": [item.pk for item in items]}, format='json')
+
+    def test_mixed_basket(self):
+        borrowing = self.lend(-3, 5, 5)
+        late, on_time, kept = borrowing.items.order_by('pk')
+
+        self.assertEqual(self.return_items(borrowing, [late, on_time]).status_code, 200)
+
+        late.refresh_from_db()
+        on_time.refresh_from_db()
+        self.assertEqual((late.penalty_amount, on_time.penalty_amount), (3, 0))
+        self.assertIsNotNone(on_time.returned_date)
+        borrowing.refresh_from_db()
+        # a late return keeps the borrowing overdue (update_status), only open items are charged on it
+        self.assertEqual((borrowing.status, borrowing.total_penalty), ('overdue', 0))
+        self.assertEqual(
+            sorted(BookCopy.objects.values_list('inventory_number', 'status')),
+            [('C-0', 'available'), ('C-1', 'available'), ('C-2', 'borrowed')]
+        )
+        self.assertEqual(
+            sorted(BookAvailability.objects.filter(library=self.library).values_list(
+                'book__title', 'available_count', 'borrowed_count'
+            )),
+            [('Book 0', 1, 0), ('Book 1', 1, 0), ('Book 2', 0, 1)]
+        )
+
+        self.assertEqual(self.return_items(borrowing, [kept]).status_code, 200)
+        borrowing.refresh_from_db()
+        self.assertEqual((borrowing.status, borrowing.total_penalty), ('returned', 0))
+
+    def test_query_count_does_not_grow_with_basket(self):
+        # borrowing, savepoint pair, item lock, item, copy and counter updates, totals
+        # aggregate and save, and the response's borrowing, items and authors
+        for due_in_days in ((5,), (5, -2, 5)):
+            borrowing = self.lend(*due_in_days)
+            items = list(borrowing.items.all())
+            with self.assertNumQueries(12):
+                self.assertEqual(self.return_items(borrowing, items).status_code, 200)
+
+
+class SweepBorrowingsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        self.library = Library.objects.create(name='Central', address='Main St')
+
+    def lend(self, *due_in_days, **fields):
+        """A borrowing with one item per due date, days from now, saved without update_status"""
+        borrowing = Borrowing.objects.create(user=self.user, **fields)
+        offset = BookCopy.objects.count()
+        for number, days in enumerate(due_in_days, offset):
+            book = Book.objects.create(isbn=f'97800000000{number:02d}', title=f'Book {number}', publication_year=2000)
+            copy = BookCopy.objects.create(book=book, library=self.library, inventory_number=f'C-{number}',
+                                           status='borrowed')
+            BorrowedItem.objects.bulk_create([
+                BorrowedItem(borrowing=borrowing, book_copy=copy, due_date=timezone.now() + timedelta(days=days))
+            ])
+        return borrowing
+
+    def test_overdue_items_are_charged_once(self):
+        late = self.lend(-3, 5)
+        on_time = self.lend(5)
+        returned = self.lend(-4, status='returned', total_penalty=2)
+        returned.items.update(returned_date=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(sweep_borrowings(chunk_size=1), 1)
+
+        late.refresh_from_db()
+        self.assertEqual((late.status, late.total_penalty), ('overdue', 3))
+        on_time.refresh_from_db()
+        self.assertEqual((on_time.status, on_time.total_penalty), ('active', 0))
+        returned.refresh_from_db()
+        self.assertEqual((returned.status, returned.total_penalty), ('returned', 2))
+
+        # nothing left to change
+        self.assertEqual(sweep_borrowings(chunk_size=1), 0)
+
+
+class ConcurrentBorrowTests(TransactionTestCase):
+    def test_one_of_two_racing_checkouts_gets_the_copy(self):
+        library = Library.objects.create(name='Central', address='Main St')
+        book = Book.objects.create(isbn='9780000000001', title='Dune', publication_year=1965)
+        copy = BookCopy.objects.create(book=book, library=library, inventory_number='C-1')
+        users = [User.objects.create(username=f'reader{number}', email=f'reader{number}@example.com')
+                 for number in range(2)]
+        due_date = str(timezone.localdate() + timedelta(days=7))
+        start = threading.Barrier(len(users))
+        codes = []
+
+        def checkout(user):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            start.wait()
+            try:
+                codes.append(client.post('/api/v1/borrowing/borrowings/borrow_books/',
+                                         {"book_copies": [copy.pk], "due_date": due_date}, format='json').status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(codes), [201, 400])
+        self.assertEqual(BorrowedItem.objects.filter(book_copy=copy).count(), 1)
+
+
+class DueRemindersTests(TestCase):
+    def setUp(self):
+        library = Library.objects.create(name='Central', address='Main St')
+        self.users = []
+        for number in range(3):
+            user = User.objects.create(username=f'reader{number}', email=f'reader{number}@example.com')
+            borrowing = Borrowing.objects.create(user=user)
+            for item in range(2):
+                book = Book.objects.create(
+                    isbn=f'978{number:05d}{item:05d}', title=f'Book {number}-{item}', publication_year=2000
+                )
+                copy = BookCopy.objects.create(
+                    book=book, library=library, inventory_number=f'C-{number}-{item}', status='borrowed'
+                )
+                BorrowedItem.objects.create(
+                    borrowing=borrowing, book_copy=copy, due_date=timezone.now() + timedelta(days=2)
+                )
+            self.users.append(user)
+
+    def test_digests_are_queued_once_per_user(self):
+        totals = send_due_reminders(batch_size=2)
+
+        self.assertEqual(totals, {'users': 3, 'items': 6})
+        self.assertEqual(
+            sorted(email.recipients[0] for email in OutboundEmail.objects.all()),
+            [user.email for user in self.users]
+        )
+        self.assertEqual(len(mail.outbox), 0)
+
+        # reminded items are skipped by the next run
+        self.assertEqual(send_due_reminders(), {'users': 0, 'items': 0})
+        self.assertEqual(OutboundEmail.objects.count(), 3)
+
+    def test_overlapping_runs_queue_each_digest_once(self):
+        iter_digests = reminders.iter_digests
+
+        def stale_digests(items):
+            # read before the other run commits, as an overlapping run would
+            digests = list(iter_digests(items))
+            with mock.patch.object(reminders, 'iter_digests', iter_digests):
+                send_due_reminders()
+            yield from digests
+
+        with mock.patch.object(reminders, 'iter_digests', stale_digests):
+            self.assertEqual(send_due_reminders(), {'users': 0, 'items': 0})
+        self.assertEqual(OutboundEmail.objects.count(), 3)
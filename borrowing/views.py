@@ -1,4 +1,4 @@
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -7,13 +7,26 @@ from datetime import timedelta
 from django.db import transaction
 from django.core.exceptions import ValidationError
 
-from .models import Borrowing, BorrowedItem, BookCopy,send_due_date_reminder
+from libraries.models import BookAvailability
+from LibraryManagementSystem.conditional import ConditionalGetMixin
+from LibraryManagementSystem.response_cache import bump, BOOKS, BORROWINGS
+from users.models import User
+from .models import Borrowing, BorrowedItem, BookCopy
+from . import reminders
 from .serializers import BorrowingSerializer, BorrowedItemSerializer, BorrowingCreateSerializer
 
 
-class BorrowingViewSet(viewsets.ModelViewSet):
+class BorrowingViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Borrowing.objects.all()
     serializer_class = BorrowingSerializer
+    etag_families = (BORROWINGS, BOOKS)
+
+    def get_etag_parts(self, request):
+        # responses are per user, and is_overdue/days_until_due move with the date
+        return super().get_etag_parts(request) + [request.user.pk, timezone.localdate()]
+
+    def get_queryset(self):
+        return BorrowingSerializer.setup_eager_loading(super().get_queryset())
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -27,14 +40,23 @@ class BorrowingViewSet(viewsets.ModelViewSet):
         book_copies = request.data.get('book_copies', [])
         due_date_str = request.data.get('due_date')
 
-        active_borrows = BorrowedItem.objects.filter(
-            borrowing__user=user,
-            returned_date__isnull=True
-        ).count()
+        if not book_copies:
+            return Response(
+                {"error": "No book copies specified"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            copy_ids = [int(copy_id) for copy_id in book_copies]
+        except (ValueError, TypeError):
+            return Response(
+                {"error": "Book copy ids must be integers"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        if active_borrows + len(book_copies) > 3:
+        if len(set(copy_ids)) != len(copy_ids):
             return Response(
-                {"error": f"You can only borrow up to 3 books. You currently have {active_borrows} active borrows."},
+                {"error": "The same book copy was requested more than once"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
@@ -53,39 +75,70 @@ class BorrowingViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        for copy_id in book_copies:
-            try:
-                copy = BookCopy.objects.get(id=copy_id)
+        # Create borrowing transaction
+        with transaction.atomic():
+            # one checkout per user at a time so the limit can't be raced
+            list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+
+            active_borrows = BorrowedItem.objects.filter(
+                borrowing__user_id=user.pk,
+                returned_date__isnull=True
+            ).count()
+
+            if active_borrows + len(copy_ids) > 3:
+                return Response(
+                    {"error": f"You can only borrow up to 3 books. You currently have {active_borrows} active borrows."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # lock the copies so concurrent checkouts can't lend the same one
+            copies = {
+                copy.id: copy
+                for copy in BookCopy.objects.select_for_update(of=('self',)).select_related('book').filter(
+                    id__in=copy_ids
+                )
+            }
+
+            for copy_id in copy_ids:
+                copy = copies.get(copy_id)
+                if copy is None:
+                    return Response(
+                        {"error": f"Book copy with ID {copy_id} not found"},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
                 if copy.status != 'available':
                     return Response(
                         {"error": f"Book {copy.book.title} is not available"},
                         status=status.HTTP_400_BAD_REQUEST
                     )
-            except BookCopy.DoesNotExist:
-                return Response(
-                    {"error": f"Book copy with ID {copy_id} not found"},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-
-        # Create borrowing transaction
-        with transaction.atomic():
-            borrowing = Borrowing.objects.create(user=user)
-
-            for copy_id in book_copies:
-                copy = BookCopy.objects.get(id=copy_id)
-                BorrowedItem.objects.create(
-                    borrowing=borrowing,
-                    book_copy=copy,
-                    due_date=due_date
-                )
 
+            # bulk_create skips BorrowedItem.save, so the status is set here instead of by update_status
+            borrowing = Borrowing.objects.create(
+                user_id=user.pk,
+                status='overdue' if due_date < timezone.now() else 'active'
+            )
+            BorrowedItem.objects.bulk_create([
+                BorrowedItem(borrowing=borrowing, book_copy_id=copy_id, due_date=due_date)
+                for copy_id in copy_ids
+            ])
+            BookCopy.objects.filter(id__in=copy_ids).update(status='borrowed')
+
+            BookAvailability.apply_deltas(BookAvailability.moves(
+                (copy.stock_state(), (copy.book_id, copy.library_id, 'borrowed'))
+                for copy in copies.values()
+            ))
+            bump(BORROWINGS)
+
+        borrowing = BorrowingSerializer.setup_eager_loading(Borrowing.objects.filter(pk=borrowing.pk)).get()
         serializer = BorrowingSerializer(borrowing)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['post'])
     def return_books(self, request, pk=None):
         """Return multiple books in a transaction"""
-        borrowing = self.get_object()
+        # not get_object(), the eager loading of the list/detail queryset is wasted here
+        borrowing = get_object_or_404(Borrowing, pk=pk)
+        self.check_object_permissions(request, borrowing)
         item_ids = request.data.get('item_ids', [])
 
         if not item_ids:
@@ -94,23 +147,24 @@ class BorrowingViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        with transaction.atomic():
-            for item_id in item_ids:
-                try:
-                    item = BorrowedItem.objects.get(id=item_id, borrowing=borrowing)
-                    if not item.returned_date:
-                        item.returned_date = timezone.now()
-                        item.save()
-                except BorrowedItem.DoesNotExist:
-                    return Response(
-                        {"error": f"Borrowed item with ID {item_id} not found"},
-                        status=status.HTTP_404_NOT_FOUND
-                    )
+        try:
+            item_ids = [int(item_id) for item_id in item_ids]
+        except (ValueError, TypeError):
+            return Response(
+                {"error": "Item ids must be integers"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        # Recalculate penalties
-        borrowing.calculate_penalties()
-        borrowing.update_status()
+        # Mark returned, release copies and recalculate penalties in bulk
+        try:
+            borrowing.return_items(item_ids)
+        except BorrowedItem.DoesNotExist as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_404_NOT_FOUND
+            )
 
+        borrowing = BorrowingSerializer.setup_eager_loading(Borrowing.objects.filter(pk=borrowing.pk)).get()
         serializer = BorrowingSerializer(borrowing)
         return Response(serializer.data)
 
@@ -124,16 +178,15 @@ class BorrowingViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def active_borrowings(self, request):
-        """Get user's active borrowings"""
+        """
+        Get user's active borrowings.
+        Status and penalties are kept current by the sweep_borrowings command
+        """
         user = request.user
-        borrowings = Borrowing.objects.filter(user=user).exclude(status='returned')
-
-        # Update status of all borrowings
-        for borrowing in borrowings:
-            borrowing.update_status()
+        borrowings = BorrowingSerializer.setup_eager_loading(
+            Borrowing.objects.filter(user_id=user.pk).exclude(status='returned')
+        )
 
-        # refresh queryset
-        borrowings = Borrowing.objects.filter(user=user).exclude(status='returned')
         serializer = BorrowingSerializer(borrowings, many=True)
         return Response(serializer.data)
 
@@ -142,29 +195,20 @@ class BorrowedItemViewSet(viewsets.ModelViewSet):
     queryset = BorrowedItem.objects.all()
     serializer_class = BorrowedItemSerializer
 
+    def get_queryset(self):
+        return BorrowedItemSerializer.setup_eager_loading(super().get_queryset())
+
     @action(detail=False, methods=['get'])
     def send_due_reminders(self, request):
         """
-        Send reminders for books due in the next 3 days
+        Queue reminders for books due in the next 3 days, sent by the send_outbox worker
         This should be called by a scheduled task/cron job daily
         """
         if not request.user.is_staff:
             return Response({"error": "Not authorized"}, status=status.HTTP_403_FORBIDDEN)
 
-        # Find items due in the next 3 days
-        now = timezone.now()
-        three_days_later = now + timedelta(days=3)
-
-        due_soon_items = BorrowedItem.objects.filter(
-            returned_date__isnull=True,
-            due_date__gte=now,
-            due_date__lte=three_days_later
-        )
-
-
-        for item in due_soon_items:
-            send_due_date_reminder(item)
+        totals = reminders.send_due_reminders()
 
         return Response({
-            "message": f"Sent {due_soon_items.count()} reminders for books due in the next 3 days"
+            "message": f"Queued {totals['users']} reminders for {totals['items']} books due in the next 3 days"
         })
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from LibraryManagementSystem.response_cache import cache_is_shared, generation, LIBRARIES
+
+
+class CoordinateSnapshot:
+    """
+    Contiguous arrays with the id, latitude and longitude of every geocoded
+    library, sorted by latitude so a bounding box maps to one slice.
+    """
+
+    def __init__(self, ids, latitudes, longitudes, generation=None):
+        order = np.argsort(latitudes, kind='stable')
+        self.ids = np.ascontiguousarray(ids[order])
+        self.latitudes = np.ascontiguousarray(latitudes[order])
+        self.longitudes = np.ascontiguousarray(longitudes[order])
+        self.built_at = time.monotonic()
+        # LIBRARIES generation the rows were read at, with a shared cache
+        self.generation = generation
+
+    @classmethod
+    def build(cls, generation=None):
+        from .models import Library
+
+        rows = list(
+            Library.objects.filter(latitude__isnull=False, longitude__isnull=False)
+            .values_list('id', 'latitude', 'longitude')
+        )
+        return cls(
+            np.array([row[0] for row in rows], dtype=np.int64),
+            np.array([row[1] for row in rows], dtype=np.float64),
+            np.array([row[2] for row in rows], dtype=np.float64),
+            generation,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def candidates(self, latitude, longitude, max_distance=None):
+        """ids, latitudes and longitudes inside the bounding box of max_distance km"""
+        if max_distance is None:
+            return self.ids, self.latitudes, self.longitudes
+
+        from .models import Library
+
+        min_lat, max_lat, lon_ranges = Library.bounding_box(latitude, longitude, max_distance)
+        start = np.searchsorted(self.latitudes, min_lat, side='left')
+        end = np.searchsorted(self.latitudes, max_lat, side='right')
+
+        ids = self.ids[start:end]
+        latitudes = self.latitudes[start:end]
+        longitudes = self.longitudes[start:end]
+
+        inside = np.zeros(len(ids), dtype=bool)
+        for min_lon, max_lon in lon_ranges:
+            inside |= (longitudes >= min_lon) & (longitudes <= max_lon)
+
+        return ids[inside], latitudes[inside], longitudes[inside]
+
+
+_snapshot = None
+_generation = 0
+_lock = threading.Lock()
+
+
+def get_coordinate_snapshot():
+    """
+    Return the cached snapshot, rebuilding it when it was invalidated.
+    Signals only reach the current process: with a shared cache other
+    workers rebuild once the LIBRARIES generation moved on, so cached
+    pages and ETags of a new generation never hold old coordinates.
+    Without one they rebuild after LIBRARY_COORDINATES_TTL seconds.
+    """
+    global _snapshot
+
+    if cache_is_shared():
+        # read before building, a bump during the build forces another one
+        current = generation(LIBRARIES)
+
+        def is_fresh(snapshot):
+            return snapshot is not None and snapshot.generation == current
+    else:
+        current = None
+        ttl = getattr(settings, 'LIBRARY_COORDINATES_TTL', 300)
+
+        def is_fresh(snapshot):
+            return snapshot is not None and time.monotonic() - snapshot.built_at < ttl
+
+    snapshot = _snapshot
+    if is_fresh(snapshot):
+        return snapshot
+
+    with _lock:
+        snapshot = _snapshot
+        if is_fresh(snapshot):
+            return snapshot
+        local_generation = _generation
+
+    snapshot = CoordinateSnapshot.build(current)
+
+    with _lock:
+        # don't publish a snapshot that was invalidated while it was built
+        if local_generation == _generation:
+            _snapshot = snapshot
+    return snapshot
+
+
+def invalidate_coordinate_snapshot():
+    global _snapshot, _generation
+
+    with _lock:
+        _snapshot = None
+        _generation += 1
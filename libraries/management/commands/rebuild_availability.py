@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from libraries.models import BookAvailability
+from LibraryManagementSystem.response_cache import bump, BOOKS, BORROWINGS
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the per-library book availability counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only compare the counters with BookCopy and report drift',
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatches = BookAvailability.find_mismatches()
+            for book_id, library_id, stored, actual in mismatches:
+                self.stdout.write(
+                    f'book {book_id} library {library_id}: '
+                    f'stored {stored[0]} available/{stored[1]} borrowed, '
+                    f'actual {actual[0]} available/{actual[1]} borrowed'
+                )
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} availability counters are out of sync')
+            self.stdout.write(self.style.SUCCESS('Availability counters are in sync'))
+            return
+
+        rows = BookAvailability.rebuild()
+        # cached responses and ETags were computed from the old counts
+        bump(BOOKS, BORROWINGS)
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt {rows} availability counters')
+        )
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libraries', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='library',
+            index=models.Index(fields=['latitude', 'longitude'], name='library_lat_lon_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_book_search_vector'),
+        ('libraries', '0002_library_lat_lon_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('available_count', models.IntegerField(default=0)),
+                ('borrowed_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='books.book')),
+                ('library', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='book_availability', to='libraries.library')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='bookavailability',
+            constraint=models.UniqueConstraint(fields=('book', 'library'), name='unique_book_library_availability'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO libraries_bookavailability (book_id, library_id, available_count, borrowed_count, updated_at)
+                SELECT book_id, library_id,
+                       COUNT(*) FILTER (WHERE status = 'available'),
+                       COUNT(*) FILTER (WHERE status <> 'available'),
+                       now()
+                FROM libraries_bookcopy
+                GROUP BY book_id, library_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
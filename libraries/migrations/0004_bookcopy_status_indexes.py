@@ -0,0 +1,21 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libraries', '0003_bookavailability'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookcopy',
+            index=models.Index(fields=['library', 'status'], name='copy_library_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookcopy',
+            index=models.Index(fields=['book', 'status'], name='copy_book_status_idx'),
+        ),
+    ]
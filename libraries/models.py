@@ -1,10 +1,15 @@
-from django.db import models
+from django.db import models, connection, transaction
 from books.models import Book
+from authors.models import AuthorBookCount
 from django.utils import timezone
 from django.utils import timezone
-from django.db.models import Count, Q
-from math import radians, sin, cos, sqrt, atan2
+from django.db.models import Count, Q, F, Exists, OuterRef
+from math import radians, degrees, sin, cos, sqrt, atan2, asin
 from django.core.paginator import Paginator
+import numpy as np
+
+from LibraryManagementSystem.response_cache import bump, BOOKS, BORROWINGS
+from .coordinates import get_coordinate_snapshot
 
 
 class Library(models.Model):
@@ -13,6 +18,14 @@ class Library(models.Model):
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
 
+    EARTH_RADIUS_KM = 6371
+    MAX_RESULTS_PER_PAGE = 100
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='library_lat_lon_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -26,10 +39,80 @@ class Library(models.Model):
         dlat = lat_2 - lat_1
         a = sin(dlat / 2) ** 2 + cos(lat_1) * cos(lat_2) * sin(dlon / 2) ** 2
         c = 2 * atan2(sqrt(a), sqrt(1 - a))
-        distance = 6371 * c
+        distance = Library.EARTH_RADIUS_KM * c
 
         return distance
 
+    @staticmethod
+    def calculate_distances(latitude, longitude, latitudes, longitudes):
+        """
+        Haversine distance in km from one point to arrays of points,
+        computed in a single vectorized pass. calculate_distance is the
+        scalar reference implementation.
+        """
+        lat_1, long_1 = np.radians(latitude), np.radians(longitude)
+        lat_2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+        long_2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+
+        dlon = long_2 - long_1
+        dlat = lat_2 - lat_1
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin(dlon / 2) ** 2
+        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+        return Library.EARTH_RADIUS_KM * c
+
+    @staticmethod
+    def nearest(distances, k):
+        """Positions of the k smallest distances, closest first"""
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+        if k >= len(distances):
+            return np.argsort(distances, kind='stable')
+
+        closest = np.argpartition(distances, k - 1)[:k]
+        return closest[np.argsort(distances[closest], kind='stable')]
+
+    @staticmethod
+    def bounding_box(latitude, longitude, max_distance):
+        """
+        Latitude range and longitude ranges that contain every point within
+        max_distance km of the given point. Longitude is split in two ranges
+        when the box crosses the antimeridian.
+        """
+        angular_distance = max_distance / Library.EARTH_RADIUS_KM
+        lat_delta = degrees(angular_distance)
+        min_lat = max(latitude - lat_delta, -90.0)
+        max_lat = min(latitude + lat_delta, 90.0)
+
+        # near the poles every longitude is in range
+        if min_lat <= -90.0 or max_lat >= 90.0:
+            return min_lat, max_lat, [(-180.0, 180.0)]
+
+        ratio = sin(angular_distance) / cos(radians(latitude))
+        if ratio >= 1:
+            return min_lat, max_lat, [(-180.0, 180.0)]
+
+        lon_delta = degrees(asin(ratio))
+        min_lon = longitude - lon_delta
+        max_lon = longitude + lon_delta
+
+        if min_lon < -180.0:
+            return min_lat, max_lat, [(min_lon + 360.0, 180.0), (-180.0, max_lon)]
+        if max_lon > 180.0:
+            return min_lat, max_lat, [(min_lon, 180.0), (-180.0, max_lon - 360.0)]
+        return min_lat, max_lat, [(min_lon, max_lon)]
+
+    @staticmethod
+    def bounding_box_filter(latitude, longitude, max_distance):
+        """Q object selecting libraries inside the bounding box (uses library_lat_lon_idx)"""
+        min_lat, max_lat, lon_ranges = Library.bounding_box(latitude, longitude, max_distance)
+
+        lon_filter = Q()
+        for min_lon, max_lon in lon_ranges:
+            lon_filter |= Q(longitude__gte=min_lon, longitude__lte=max_lon)
+
+        return Q(latitude__gte=min_lat, latitude__lte=max_lat) & lon_filter
+
 
     @staticmethod
     def filter_libraries(category=None, author=None, user_latitude=None, user_longitude=None,
@@ -49,50 +132,67 @@ class Library(models.Model):
 
         # Calculate distance
         if user_latitude is not None and user_longitude is not None:
-            libraries = libraries.filter(latitude__isnull=False, longitude__isnull=False)
+            user_latitude = float(user_latitude)
+            user_longitude = float(user_longitude)
+            if max_distance is not None:
+                max_distance = float(max_distance)
 
-            # Create a list with distances
-            library_distances = []
-            for library in libraries:
-                distance = Library.calculate_distance(
-                    float(user_latitude), float(user_longitude),
-                    library.latitude, library.longitude
-                )
+            # Coordinates come from the in-process snapshot, the database is
+            # only used for category/author filters and the final page
+            library_ids, latitudes, longitudes = get_coordinate_snapshot().candidates(
+                user_latitude, user_longitude, max_distance
+            )
 
-                # Apply distance filter
-                if max_distance is None or distance <= float(max_distance):
-                    library_distances.append({
-                        'library': library,
-                        'distance': distance
-                    })
+            if category or author:
+                if max_distance is not None:
+                    libraries = libraries.filter(
+                        Library.bounding_box_filter(user_latitude, user_longitude, max_distance)
+                    )
+                matching_ids = np.fromiter(libraries.values_list('id', flat=True), dtype=np.int64)
+                matching = np.isin(library_ids, matching_ids)
+                library_ids = library_ids[matching]
+                latitudes = latitudes[matching]
+                longitudes = longitudes[matching]
 
-            # Sort distance
-            library_distances.sort(key=lambda x: x['distance'])
+            distances = Library.calculate_distances(user_latitude, user_longitude, latitudes, longitudes)
 
-            libraries_list = [item['library'] for item in library_distances]
+            # Apply distance filter
+            if max_distance is not None:
+                within = distances <= max_distance
+                library_ids = library_ids[within]
+                distances = distances[within]
 
+            total_libraries = len(library_ids)
             start_idx = (page - 1) * results_per_page
             end_idx = start_idx + results_per_page
-            paginated_libraries = libraries_list[start_idx:end_idx]
+
+            # Only the first end_idx libraries need to be ordered
+            page_positions = Library.nearest(distances, end_idx)[start_idx:end_idx]
+            page_ids = library_ids[page_positions].tolist()
+            libraries_by_id = Library.objects.in_bulk(page_ids)
 
             result = []
-            for idx, library in enumerate(paginated_libraries):
+            for position, library_id in zip(page_positions, page_ids):
+                library = libraries_by_id.get(library_id)
+                if library is None:
+                    # deleted since the snapshot was built
+                    continue
                 library_data = {
                     'id': library.id,
                     'name': library.name,
                     'address': library.address,
                     'latitude': library.latitude,
                     'longitude': library.longitude,
-                    'distance': library_distances[start_idx + idx]['distance']
+                    'distance': float(distances[position])
                 }
                 result.append(library_data)
 
             return {
                 'libraries': result,
-                'total_libraries': len(libraries_list),
-                'total_pages': (len(libraries_list) + results_per_page - 1) // results_per_page,
+                'total_libraries': total_libraries,
+                'total_pages': (total_libraries + results_per_page - 1) // results_per_page,
                 'current_page': page,
-                'has_next': end_idx < len(libraries_list),
+                'has_next': end_idx < total_libraries,
                 'has_previous': page > 1
             }
         else:
@@ -131,6 +231,317 @@ class BookCopy(models.Model):
     inventory_number = models.CharField(max_length=50)
     added_date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['library', 'status'], name='copy_library_status_idx'),
+            models.Index(fields=['book', 'status'], name='copy_book_status_idx'),
+        ]
+
     def __str__(self):
         return f"{self.book.title} ({self.library.name})"
 
+    def stock_state(self):
+        return self.book_id, self.library_id, self.status
+
+    def save(self, *args, **kwargs):
+        """
+        Save the copy and move it between the availability counters. The
+        previous state is read from the locked row, not from the instance,
+        so concurrent saves of one copy each apply their own transition.
+        """
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                previous = type(self).objects.select_for_update().filter(pk=self.pk).values_list(
+                    'book_id', 'library_id', 'status'
+                ).first()
+            current = self.saved_stock_state(previous, kwargs.get('update_fields'))
+
+            # read by the post_save receivers
+            self._stock_change = (previous, current)
+            super().save(*args, **kwargs)
+            BookAvailability.apply_deltas(BookAvailability.state_change(previous, current))
+
+    def saved_stock_state(self, previous, update_fields=None):
+        """(book_id, library_id, status) as they will be after save(update_fields=...)"""
+        if previous is None:
+            return self.stock_state()
+
+        deferred = self.get_deferred_fields()
+        state = []
+        for name, attname, old in zip(('book', 'library', 'status'), ('book_id', 'library_id', 'status'), previous):
+            written = attname not in deferred and (
+                update_fields is None or name in update_fields or attname in update_fields
+            )
+            state.append(self.__dict__[attname] if written else old)
+        return tuple(state)
+
+    @classmethod
+    def lock_for_bulk(cls, copy_ids=None, inventory_numbers=None, library_id=None):
+        """
+        Lock the copies named by id, or by inventory number within an
+        optional library, in one query. Returns (key, copy, error) tuples in
+        request order; error is 'not_found' or 'ambiguous' when copy is None.
+        """
+        copies = cls.objects.select_for_update().order_by('pk')
+
+        if copy_ids is not None:
+            found = {copy.pk: copy for copy in copies.filter(pk__in=copy_ids)}
+            return [
+                (copy_id, found.get(copy_id), None if copy_id in found else 'not_found')
+                for copy_id in copy_ids
+            ]
+
+        if library_id:
+            copies = copies.filter(library_id=library_id)
+        found = {}
+        for copy in copies.filter(inventory_number__in=inventory_numbers):
+            found.setdefault(copy.inventory_number, []).append(copy)
+
+        resolved = []
+        for number in inventory_numbers:
+            matches = found.get(number, [])
+            if not matches:
+                resolved.append((number, None, 'not_found'))
+            elif len(matches) > 1:
+                resolved.append((number, None, 'ambiguous'))
+            else:
+                resolved.append((number, matches[0], None))
+        return resolved
+
+    @classmethod
+    def on_loan_ids(cls, resolved):
+        """Ids of the resolved copies that have an open loan"""
+        # an Exists, a filter across borrow_records would also match copies never lent
+        BorrowedItem = cls._meta.get_field('borrow_records').related_model
+        return set(
+            cls.objects.filter(
+                Exists(BorrowedItem.objects.filter(book_copy_id=OuterRef('pk'), returned_date__isnull=True)),
+                pk__in=[copy.pk for _, copy, _ in resolved if copy]
+            ).values_list('pk', flat=True)
+        )
+
+    @classmethod
+    def bulk_transfer(cls, library_id, copy_ids=None, inventory_numbers=None, from_library_id=None):
+        """
+        Move copies to another library in one transaction with a single
+        UPDATE. Copies with an open loan are left alone, they are returned
+        to the library they were lent from. Returns a per-copy outcome list.
+        """
+        with transaction.atomic():
+            if not Library.objects.filter(pk=library_id).exists():
+                raise Library.DoesNotExist(f"Library with ID {library_id} not found")
+
+            resolved = cls.lock_for_bulk(copy_ids, inventory_numbers, from_library_id)
+            on_loan = cls.on_loan_ids(resolved)
+
+            outcomes = []
+            changes = []
+            moved = []
+            for key, copy, error in resolved:
+                if error:
+                    outcomes.append({"key": key, "result": error})
+                    continue
+                if copy.library_id == library_id:
+                    outcomes.append({"key": key, "id": copy.pk, "result": "unchanged"})
+                    continue
+                if copy.pk in on_loan:
+                    outcomes.append({"key": key, "id": copy.pk, "result": "on_loan"})
+                    continue
+
+                changes.append((copy.stock_state(), (copy.book_id, library_id, copy.status)))
+                copy.library_id = library_id
+                moved.append(copy.pk)
+                outcomes.append({"key": key, "id": copy.pk, "result": "transferred"})
+
+            if moved:
+                cls.objects.filter(pk__in=moved).update(library_id=library_id)
+                BookAvailability.apply_deltas(BookAvailability.moves(changes))
+                AuthorBookCount.refresh(AuthorBookCount.authors_of_books({book_id for (book_id, _, _), _ in changes}))
+                bump(BOOKS)
+
+        return outcomes
+
+    @classmethod
+    def bulk_set_status(cls, status, copy_ids=None, inventory_numbers=None, library_id=None):
+        """
+        Stocktake correction: set the status of many copies in one
+        transaction with a single UPDATE. Copies with an open loan are left
+        alone. Returns a per-copy outcome list.
+        """
+        if status not in dict(cls.STATUS_CHOICES):
+            raise ValueError(f"Invalid status {status}")
+
+        with transaction.atomic():
+            resolved = cls.lock_for_bulk(copy_ids, inventory_numbers, library_id)
+            on_loan = cls.on_loan_ids(resolved)
+
+            outcomes = []
+            changes = []
+            changed = []
+            for key, copy, error in resolved:
+                if error:
+                    outcomes.append({"key": key, "result": error})
+                    continue
+                if copy.status == status:
+                    outcomes.append({"key": key, "id": copy.pk, "result": "unchanged"})
+                    continue
+                if copy.pk in on_loan:
+                    outcomes.append({"key": key, "id": copy.pk, "result": "on_loan"})
+                    continue
+
+                changes.append((copy.stock_state(), (copy.book_id, copy.library_id, status)))
+                copy.status = status
+                changed.append(copy.pk)
+                outcomes.append({"key": key, "id": copy.pk, "result": "updated"})
+
+            if changed:
+                cls.objects.filter(pk__in=changed).update(status=status)
+                BookAvailability.apply_deltas(BookAvailability.moves(changes))
+                bump(BORROWINGS)
+
+        return outcomes
+
+
+class BookAvailability(models.Model):
+    """Available/borrowed copy counts per (book, library), maintained on every copy change"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='availability')
+    library = models.ForeignKey(Library, on_delete=models.CASCADE, related_name='book_availability')
+    available_count = models.IntegerField(default=0)
+    borrowed_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'library'], name='unique_book_library_availability'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} @ {self.library_id}: {self.available_count} available"
+
+    @staticmethod
+    def state_change(previous, current):
+        """
+        Counter deltas for a copy moving from previous to current
+        (book_id, library_id, status) state, either of which may be None
+        """
+        deltas = {}
+        for state, sign in ((previous, -1), (current, 1)):
+            if state is None:
+                continue
+            book_id, library_id, status = state
+            available, borrowed = deltas.get((book_id, library_id), (0, 0))
+            if status == 'available':
+                available += sign
+            else:
+                borrowed += sign
+            deltas[(book_id, library_id)] = (available, borrowed)
+        return deltas
+
+    @classmethod
+    def moves(cls, changes):
+        """Summed counter deltas for an iterable of (previous, current) copy states"""
+        deltas = {}
+        for previous, current in changes:
+            for key, (available, borrowed) in cls.state_change(previous, current).items():
+                total_available, total_borrowed = deltas.get(key, (0, 0))
+                deltas[key] = (total_available + available, total_borrowed + borrowed)
+        return deltas
+
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """
+        Add {(book_id, library_id): (available, borrowed)} deltas to the
+        counters with a single upsert. Rows are touched in key order so
+        concurrent writers can't deadlock.
+        """
+        rows = sorted(
+            (key, delta) for key, delta in deltas.items() if delta != (0, 0)
+        )
+        if not rows:
+            return
+
+        table = connection.ops.quote_name(cls._meta.db_table)
+        values = ', '.join(['(%s, %s, %s, %s, now())'] * len(rows))
+        params = []
+        for (book_id, library_id), (available, borrowed) in rows:
+            params.extend([book_id, library_id, available, borrowed])
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (book_id, library_id, available_count, borrowed_count, updated_at)
+                VALUES {values}
+                ON CONFLICT (book_id, library_id) DO UPDATE SET
+                    available_count = {table}.available_count + EXCLUDED.available_count,
+                    borrowed_count = {table}.borrowed_count + EXCLUDED.borrowed_count,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                params
+            )
+
+    @classmethod
+    def release(cls, deltas):
+        """
+        Subtract deltas without creating rows, for deleted copies whose
+        book or library may be deleted in the same transaction
+        """
+        for (book_id, library_id), (available, borrowed) in sorted(deltas.items()):
+            cls.objects.filter(book_id=book_id, library_id=library_id).update(
+                available_count=F('available_count') + available,
+                borrowed_count=F('borrowed_count') + borrowed,
+                updated_at=timezone.now()
+            )
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every counter from BookCopy"""
+        table = connection.ops.quote_name(cls._meta.db_table)
+        copies = connection.ops.quote_name(BookCopy._meta.db_table)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {copies} IN SHARE MODE")
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (book_id, library_id, available_count, borrowed_count, updated_at)
+                SELECT book_id, library_id,
+                       COUNT(*) FILTER (WHERE status = 'available'),
+                       COUNT(*) FILTER (WHERE status <> 'available'),
+                       now()
+                FROM {copies}
+                GROUP BY book_id, library_id
+                """
+            )
+            return cursor.rowcount
+
+    @classmethod
+    def find_mismatches(cls):
+        """(book_id, library_id, stored, actual) for every counter that drifted from BookCopy"""
+        table = connection.ops.quote_name(cls._meta.db_table)
+        copies = connection.ops.quote_name(BookCopy._meta.db_table)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT COALESCE(a.book_id, c.book_id), COALESCE(a.library_id, c.library_id),
+                       a.available_count, a.borrowed_count, c.available_count, c.borrowed_count
+                FROM {table} a
+                FULL OUTER JOIN (
+                    SELECT book_id, library_id,
+                           COUNT(*) FILTER (WHERE status = 'available') AS available_count,
+                           COUNT(*) FILTER (WHERE status <> 'available') AS borrowed_count
+                    FROM {copies}
+                    GROUP BY book_id, library_id
+                ) c ON c.book_id = a.book_id AND c.library_id = a.library_id
+                WHERE COALESCE(a.available_count, 0) <> COALESCE(c.available_count, 0)
+                   OR COALESCE(a.borrowed_count, 0) <> COALESCE(c.borrowed_count, 0)
+                """
+            )
+            return [
+                (book_id, library_id, (stored_available or 0, stored_borrowed or 0),
+                 (actual_available or 0, actual_borrowed or 0))
+                for book_id, library_id, stored_available, stored_borrowed, actual_available, actual_borrowed
+                in cursor.fetchall()
+            ]
+
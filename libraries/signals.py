@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from LibraryManagementSystem.response_cache import bump, BOOKS, BORROWINGS, LIBRARIES
+from .coordinates import invalidate_coordinate_snapshot
+from .models import Library, BookCopy, BookAvailability
+
+
+@receiver(post_save, sender=Library)
+@receiver(post_delete, sender=Library)
+def library_changed(sender, instance, **kwargs):
+    """Drop the coordinate snapshot and cached library responses once the change is committed"""
+    transaction.on_commit(invalidate_coordinate_snapshot)
+    bump(LIBRARIES)
+
+
+@receiver(post_save, sender=BookCopy)
+def book_copy_saved(sender, instance, created, **kwargs):
+    """Catalogue responses depend on which library holds a book, availability on the status"""
+    previous, current = getattr(instance, '_stock_change', (None, instance.stock_state()))
+    if previous is None or previous[:2] != current[:2]:
+        bump(BOOKS)
+    if previous is None or previous[2] != current[2]:
+        bump(BORROWINGS)
+
+
+@receiver(post_delete, sender=BookCopy)
+def book_copy_deleted(sender, instance, **kwargs):
+    """Take a deleted copy out of the availability counters"""
+    BookAvailability.release(BookAvailability.state_change(instance.stock_state(), None))
+    bump(BOOKS, BORROWINGS)
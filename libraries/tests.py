@@ -1,3 +1,262 @@
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authors.models import Author
+from books.models import Book, Category
+from borrowing.models import Borrowing, BorrowedItem
+from LibraryManagementSystem.query_plans import index_plan
+from LibraryManagementSystem.response_cache import generation_key, LIBRARIES
+from users.models import User
+from .coordinates import get_coordinate_snapshot, invalidate_coordinate_snapshot
+from .models import Library, BookCopy, BookAvailability
+
+
+class BookCopyAvailabilityTests(TestCase):
+    def setUp(self):
+        self.library = Library.objects.create(name='Central', address='Main St')
+        self.book = Book.objects.create(isbn='9780000000001', title='Dune', publication_year=1965)
+        self.copy = BookCopy.objects.create(book=self.book, library=self.library, inventory_number='C-1')
+
+    def counters(self):
+        return BookAvailability.objects.values_list('available_count', 'borrowed_count').get(
+            book=self.book, library=self.library
+        )
+
+    def test_stale_instances_apply_one_transition(self):
+        first = BookCopy.objects.get(pk=self.copy.pk)
+        second = BookCopy.objects.get(pk=self.copy.pk)
+
+        first.status = 'borrowed'
+        first.save()
+        second.status = 'borrowed'
+        second.save()
+
+        self.assertEqual(self.counters(), (0, 1))
+
+    def test_deferred_copy_is_not_counted_as_new(self):
+        copy = BookCopy.objects.only('id', 'status').get(pk=self.copy.pk)
+        copy.status = 'borrowed'
+        copy.save()
+
+        self.assertEqual(self.counters(), (0, 1))
+
+    def test_update_fields_keep_unsaved_changes_out(self):
+        other = Library.objects.create(name='Branch', address='Side St')
+        copy = BookCopy.objects.get(pk=self.copy.pk)
+        copy.library = other
+        copy.status = 'borrowed'
+        copy.save(update_fields=['status'])
+
+        self.assertEqual(self.counters(), (0, 1))
+        self.assertFalse(BookAvailability.objects.filter(library=other, available_count__gt=0).exists())
+
+
+class BookCopyIndexTests(TestCase):
+    def setUp(self):
+        self.library = Library.objects.create(name='Central', address='Main St')
+        self.book = Book.objects.create(isbn='9780000000001', title='Dune', publication_year=1965)
+        BookCopy.objects.create(book=self.book, library=self.library, inventory_number='C-1')
+
+    def test_library_status_filter_uses_index(self):
+        copies = BookCopy.objects.filter(library=self.library, status='available')
+        self.assertIn('copy_library_status_idx', index_plan(copies))
+
+    def test_book_status_filter_uses_index(self):
+        copies = BookCopy.objects.filter(book=self.book, status='available')
+        self.assertIn('copy_book_status_idx', index_plan(copies))
+
+
+class BulkTransferTests(TestCase):
+    def setUp(self):
+        self.library = Library.objects.create(name='Central', address='Main St')
+        self.branch = Library.objects.create(name='Branch', address='High St')
+        book = Book.objects.create(isbn='9780000000001', title='Dune', publication_year=1965)
+        self.shelved = BookCopy.objects.create(book=book, library=self.library, inventory_number='C-1')
+        self.lent = BookCopy.objects.create(book=book, library=self.library, inventory_number='C-2',
+                                            status='borrowed')
+        borrowing = Borrowing.objects.create(user=User.objects.create(username='reader', email='reader@example.com'))
+        BorrowedItem.objects.create(borrowing=borrowing, book_copy=self.lent,
+                                    due_date=timezone.now() + timedelta(days=7))
+
+    def test_copies_on_loan_are_not_transferred(self):
+        outcomes = BookCopy.bulk_transfer(self.branch.pk, copy_ids=[self.shelved.pk, self.lent.pk])
+
+        self.assertEqual([outcome["result"] for outcome in outcomes], ["transferred", "on_loan"])
+        self.lent.refresh_from_db()
+        self.assertEqual(self.lent.library_id, self.library.pk)
+
+    def test_selection_must_be_a_list(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create(username='admin', email='admin@example.com', role='admin'))
+        for body in ({"library": self.branch.pk, "copies": "12"},
+                     {"library": self.branch.pk, "inventory_numbers": "C-1"}):
+            response = client.post('/api/v1/libraries/copies/bulk_transfer/', body, format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+class BulkSetStatusTests(TestCase):
+    url = '/api/v1/libraries/copies/bulk_status/'
+
+    def setUp(self):
+        self.library = Library.objects.create(name='Central', address='Main St')
+        self.book = Book.objects.create(isbn='9780000000001', title='Dune', publication_year=1965)
+        self.shelved, self.stocktake, self.stale, self.lent = [
+            BookCopy.objects.create(book=self.book, library=self.library, inventory_number=f'C-{number}',
+                                    status=status)
+            for number, status in enumerate(('available', 'available', 'borrowed', 'borrowed'), 1)
+        ]
+        borrowing = Borrowing.objects.create(user=User.objects.create(username='reader', email='reader@example.com'))
+        BorrowedItem.objects.create(borrowing=borrowing, book_copy=self.lent,
+                                    due_date=timezone.now() + timedelta(days=7))
+
+    def counters(self):
+        return BookAvailability.objects.values_list('available_count', 'borrowed_count').get(
+            book=self.book, library=self.library
+        )
+
+    def test_outcomes_and_counters(self):
+        self.assertEqual(self.counters(), (2, 2))
+
+        outcomes = BookCopy.bulk_set_status(
+            'available', inventory_numbers=['C-1', 'C-3', 'C-4', 'C-9'], library_id=self.library.pk
+        )
+
+        self.assertEqual([(outcome["key"], outcome["result"]) for outcome in outcomes],
+                         [('C-1', 'unchanged'), ('C-3', 'updated'), ('C-4', 'on_loan'), ('C-9', 'not_found')])
+        self.assertEqual(
+            sorted(BookCopy.objects.values_list('inventory_number', 'status')),
+            [('C-1', 'available'), ('C-2', 'available'), ('C-3', 'available'), ('C-4', 'borrowed')]
+        )
+        self.assertEqual(self.counters(), (3, 1))
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create(username='admin', email='admin@example.com', role='admin'))
+
+        response = client.post(self.url, {"status": 'borrowed', "copies": [self.stocktake.pk, self.lent.pk, 0]},
+                               format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([outcome["result"] for outcome in response.data["results"]],
+                         ['updated', 'unchanged', 'not_found'])
+        self.assertEqual(self.counters(), (1, 3))
+
+        response = client.post(self.url, {"status": 'lost', "copies": [self.shelved.pk]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.counters(), (1, 3))
+
+
+class CoordinateSnapshotTests(TestCase):
+    def setUp(self):
+        self.library = Library.objects.create(name='Central', address='Main St', latitude=30.0, longitude=31.0)
+        invalidate_coordinate_snapshot()
+
+    def test_shared_cache_rebuilds_on_a_new_generation(self):
+        with mock.patch('libraries.coordinates.cache_is_shared', return_value=True):
+            self.assertEqual(get_coordinate_snapshot().latitudes.tolist(), [30.0])
+
+            # another worker's write: no signal here, only the generation moves
+            Library.objects.filter(pk=self.library.pk).update(latitude=40.0)
+            self.assertIs(get_coordinate_snapshot(), get_coordinate_snapshot())
+            cache.incr(generation_key(LIBRARIES))
+
+            self.assertEqual(get_coordinate_snapshot().latitudes.tolist(), [40.0])
+
+
+class DistanceTests(TestCase):
+    def test_vectorized_distances_match_the_scalar_ones(self):
+        rng = np.random.default_rng(7)
+        points = [(0.0, 0.0), (89.9, 10.0), (-89.9, -170.0), (10.0, 179.9), (-10.0, -179.9)]
+        points += [tuple(point) for point in rng.uniform((-90, -180), (90, 180), size=(20, 2))]
+        latitudes = np.concatenate([rng.uniform(-90, 90, 50), [89.99, -89.99, 0.0, 45.0]])
+        longitudes = np.concatenate([rng.uniform(-180, 180, 50), [-179.99, 179.99, 180.0, -180.0]])
+
+        for latitude, longitude in points:
+            distances = Library.calculate_distances(latitude, longitude, latitudes, longitudes)
+            for distance, other_latitude, other_longitude in zip(distances, latitudes, longitudes):
+                self.assertAlmostEqual(
+                    distance, Library.calculate_distance(latitude, longitude, other_latitude, other_longitude),
+                    places=6
+                )
+
+    def test_nearest_matches_argsort(self):
+        distances = np.random.default_rng(7).uniform(0, 100, 30)
+        for k in (0, 1, 5, 29, 30, 31, 100):
+            self.assertEqual(Library.nearest(distances, k).tolist(), np.argsort(distances)[:k].tolist())
+
+
+class BoundingBoxTests(TestCase):
+    @staticmethod
+    def contains(box, latitude, longitude):
+        min_lat, max_lat, lon_ranges = box
+        return min_lat <= latitude <= max_lat and any(
+            min_lon <= longitude <= max_lon for min_lon, max_lon in lon_ranges
+        )
+
+    def assert_keeps_points_within(self, latitude, longitude, max_distance, points):
+        box = Library.bounding_box(latitude, longitude, max_distance)
+        for point in points:
+            if Library.calculate_distance(latitude, longitude, *point) <= max_distance:
+                self.assertTrue(self.contains(box, *point), f"{point} dropped around {(latitude, longitude)}")
+
+    def test_antimeridian(self):
+        for longitude in (179.9, -179.9):
+            box = Library.bounding_box(0.0, longitude, 50)
+            self.assertEqual(len(box[2]), 2)
+            self.assertTrue(self.contains(box, 0.0, -longitude))
+
+    def test_poles(self):
+        for latitude in (89.9, -89.9):
+            box = Library.bounding_box(latitude, 0.0, 50)
+            self.assertEqual(box[2], [(-180.0, 180.0)])
+            self.assertTrue(self.contains(box, latitude, 180.0))
+
+    def test_distance_wider_than_the_parallel(self):
+        # sin(1500 / R) > cos(80°): every longitude is in range
+        self.assertEqual(Library.bounding_box(80.0, 0.0, 1500)[2], [(-180.0, 180.0)])
+
+    def test_no_point_within_max_distance_is_dropped(self):
+        rng = np.random.default_rng(7)
+        centers = [(0.0, 179.9), (0.0, -179.9), (89.9, 0.0), (-89.9, 90.0), (80.0, 0.0), (60.0, 178.0)]
+        for latitude, longitude in centers + [tuple(point) for point in rng.uniform((-85, -180), (85, 180), (10, 2))]:
+            for max_distance in (10, 200, 1500):
+                delta = np.degrees(max_distance / Library.EARTH_RADIUS_KM) * 1.5
+                points = zip(
+                    np.clip(latitude + rng.uniform(-delta, delta, 200), -90, 90),
+                    (longitude + rng.uniform(-180, 180, 200) + 180) % 360 - 180,
+                )
+                self.assert_keeps_points_within(latitude, longitude, max_distance, points)
+
+
+class FilterLibrariesTests(TestCase):
+    def setUp(self):
+        self.near = Library.objects.create(name='Downtown', address='Tahrir', latitude=30.04, longitude=31.24)
+        self.empty = Library.objects.create(name='Zamalek', address='Nile St', latitude=30.06, longitude=31.22)
+        self.far = Library.objects.create(name='Alexandria', address='Corniche', latitude=31.2, longitude=29.92)
+        self.category = Category.objects.create(name='Science Fiction')
+        self.author = Author.objects.create(user=User.objects.create(username='herbert', email='herbert@example.com'))
+        book = Book.objects.create(isbn='9780000000001', title='Dune', publication_year=1965)
+        book.categories.add(self.category)
+        book.authors.add(self.author)
+        for number, library in enumerate((self.near, self.far)):
+            BookCopy.objects.create(book=book, library=library, inventory_number=f'C-{number}')
+        invalidate_coordinate_snapshot()
+
+    def names(self, **filters):
+        result = Library.filter_libraries(user_latitude=30.04, user_longitude=31.24, **filters)
+        return [library['name'] for library in result['libraries']]
+
+    def test_category_and_distance(self):
+        self.assertEqual(self.names(category=self.category.pk, max_distance=50), ['Downtown'])
 
-# Create your tests here.
+    def test_author_and_distance(self):
+        self.assertEqual(self.names(author=self.author.pk, max_distance=500), ['Downtown', 'Alexandria'])
+        self.assertEqual(self.names(author=self.author.pk), ['Downtown', 'Alexandria'])
+        self.assertEqual(self.names(max_distance=50), ['Downtown', 'Zamalek'])
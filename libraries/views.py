@@ -5,13 +5,19 @@ from .serializers import LibrarySerializer, BookCopySerializer
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from users.permissions import IsAdmin
+from LibraryManagementSystem.response_cache import cached_response, BOOKS, LIBRARIES
+from LibraryManagementSystem.conditional import ConditionalGetMixin
 
 
-class LibraryViewSet(viewsets.ModelViewSet):
+class LibraryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Library.objects.all()
     serializer_class = LibrarySerializer
+    etag_families = (LIBRARIES, BOOKS)
 
     @action(detail=False, methods=['get'])
+    @cached_response(LIBRARIES, BOOKS)
     def filter_libraries(self, request):
         """
         Filter libraries by category, author, and calculate distances
@@ -31,6 +37,7 @@ class LibraryViewSet(viewsets.ModelViewSet):
             results_per_page = int(request.query_params.get('results_per_page', 10))
         except ValueError:
             results_per_page = 10
+        results_per_page = min(max(results_per_page, 1), Library.MAX_RESULTS_PER_PAGE)
 
         result = Library.filter_libraries(
             category=category,
@@ -73,6 +80,7 @@ class LibraryViewSet(viewsets.ModelViewSet):
             results_per_page = int(request.query_params.get('results_per_page', 10))
         except ValueError:
             results_per_page = 10
+        results_per_page = min(max(results_per_page, 1), Library.MAX_RESULTS_PER_PAGE)
 
         result = Library.filter_libraries(
             user_latitude=user_latitude,
@@ -88,3 +96,65 @@ class LibraryViewSet(viewsets.ModelViewSet):
 class BookCopyViewSet(viewsets.ModelViewSet):
     queryset = BookCopy.objects.all()
     serializer_class = BookCopySerializer
+
+    @staticmethod
+    def copy_selection(request):
+        """copies (ids) or inventory_numbers from the request body"""
+        copy_ids = request.data.get('copies')
+        inventory_numbers = request.data.get('inventory_numbers')
+
+        for name, value in (('copies', copy_ids), ('inventory_numbers', inventory_numbers)):
+            if value is not None and not isinstance(value, list):
+                raise ValidationError({"error": f"{name} must be a list"})
+
+        if copy_ids:
+            try:
+                return {'copy_ids': [int(copy_id) for copy_id in copy_ids]}
+            except (ValueError, TypeError):
+                raise ValidationError({"error": "Copy ids must be integers"})
+        if inventory_numbers:
+            return {'inventory_numbers': [str(number) for number in inventory_numbers]}
+        raise ValidationError({"error": "Either copies or inventory_numbers is required"})
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdmin])
+    def bulk_transfer(self, request):
+        """Move many copies to another library"""
+        selection = self.copy_selection(request)
+
+        try:
+            library_id = int(request.data.get('library'))
+            from_library_id = request.data.get('from_library')
+            from_library_id = int(from_library_id) if from_library_id else None
+        except (ValueError, TypeError):
+            return Response(
+                {"error": "library must be a library id"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            outcomes = BookCopy.bulk_transfer(library_id, from_library_id=from_library_id, **selection)
+        except Library.DoesNotExist as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({"results": outcomes})
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdmin])
+    def bulk_status(self, request):
+        """Set the status of many copies, e.g. after a stocktake"""
+        selection = self.copy_selection(request)
+
+        try:
+            library_id = request.data.get('library')
+            library_id = int(library_id) if library_id else None
+        except (ValueError, TypeError):
+            return Response(
+                {"error": "library must be a library id"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            outcomes = BookCopy.bulk_set_status(request.data.get('status'), library_id=library_id, **selection)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"results": outcomes})
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+
+from django.db import connection, connections
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'notifications'
+
+
+def publish(user_ids):
+    """
+    NOTIFY every worker that these users have new notifications. NOTIFY is
+    transactional, so listeners only hear about rows that were committed.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_notify(%s, user_id::text) FROM unnest(%s::bigint[]) AS user_id",
+            [CHANNEL, user_ids]
+        )
+
+
+class Broker:
+    """
+    In-process pub/sub from user id to the streams open for that user.
+
+    Every ASGI worker holds one LISTEN connection and wakes the matching
+    streams when a NOTIFY arrives. Wake-ups carry no data: a stream reads
+    its new rows itself, so coalesced or duplicated wake-ups are harmless.
+    User ids are keyed as ints, token users carry theirs as a string.
+    """
+
+    RECONNECT_DELAY = 5
+
+    def __init__(self):
+        self.subscribers = {}
+        self.listening = False
+        self._listener = None
+        self._connection = None
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.setdefault(int(user_id), set()).add(queue)
+        self.start()
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        user_id = int(user_id)
+        queues = self.subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    def dispatch(self, user_id):
+        for queue in self.subscribers.get(int(user_id), ()):
+            if queue.empty():
+                queue.put_nowait(True)
+
+    def start(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self.listen())
+
+    async def listen(self):
+        """Keep a LISTEN connection open while this worker has streams, reconnecting on failure"""
+        loop = asyncio.get_running_loop()
+        while self.subscribers:
+            closed = loop.create_future()
+            failed = False
+            try:
+                self._connection = await loop.run_in_executor(None, self.connect)
+                loop.add_reader(self._connection.fileno(), self.read, closed)
+                self.listening = True
+                await closed
+            except Exception as e:
+                logger.warning("Notification listener disconnected: %s", e)
+                failed = True
+            finally:
+                self.listening = False
+                self.close(loop)
+            if failed:
+                await asyncio.sleep(self.RECONNECT_DELAY)
+
+    @staticmethod
+    def connect():
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        params = connections['default'].get_connection_params()
+        listener = psycopg2.connect(**params)
+        listener.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with listener.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        return listener
+
+    def read(self, closed):
+        try:
+            self._connection.poll()
+        except Exception as e:
+            if not closed.done():
+                closed.set_exception(e)
+            return
+
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            try:
+                self.dispatch(int(notify.payload))
+            except ValueError:
+                continue
+
+        if not self.subscribers and not closed.done():
+            # last stream went away, release the connection
+            closed.set_result(None)
+
+    def close(self, loop):
+        if self._connection is None:
+            return
+        try:
+            loop.remove_reader(self._connection.fileno())
+        except Exception:
+            pass
+        self._connection.close()
+        self._connection = None
+
+
+broker = Broker()
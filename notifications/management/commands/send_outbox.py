@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from notifications.outbox import deliver_outbox
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the outbox, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Parallel SMTP connections',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Emails claimed per round',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds to sleep when the outbox is empty',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the outbox once and exit instead of polling',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be at least 1')
+
+        total = 0
+        while True:
+            processed = deliver_outbox(batch_size=options['batch_size'], workers=options['workers'])
+            total += processed
+
+            if not processed:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully processed {total} emails')
+        )
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.20 on 2026-10-18 20:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrowing', '0005_jobcheckpoint'),
+        ('notifications', '0002_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='borrowed_item',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='borrowing.borroweditem'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='due_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('borrowed_item__isnull', False)), fields=('borrowed_item', 'notification_type', 'due_date'), name='unique_item_notification_per_due_date'),
+        ),
+    ]
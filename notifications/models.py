@@ -1,4 +1,10 @@
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Q
+from LibraryManagementSystem.response_cache import cache_is_shared, generation, generation_key, new_generation
+from . import events
+from django.utils import timezone
 from users.models import User
 from libraries.models import BookCopy
 
@@ -20,6 +26,159 @@ class Notification(models.Model):
     book_copy = models.ForeignKey(BookCopy, on_delete=models.SET_NULL, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
+    # due-date notifications: the loan and the due date they were sent for
+    borrowed_item = models.ForeignKey('borrowing.BorrowedItem', on_delete=models.CASCADE, null=True, blank=True,
+                                      related_name='notifications')
+    due_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['borrowed_item', 'notification_type', 'due_date'],
+                                    condition=Q(borrowed_item__isnull=False),
+                                    name='unique_item_notification_per_due_date'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'read', 'created_at'], name='notification_inbox_idx'),
+        ]
 
     def __str__(self):
         return f"{self.notification_type} for {self.user.username}"
+
+    @staticmethod
+    def unread_family(user_id):
+        return f'notifications-unread:{user_id}'
+
+    @classmethod
+    def unread_cache_key(cls, user_id):
+        """Counter key under the user's current version, bumped whenever a write finds no counter"""
+        return f'notifications:unread:{user_id}:{generation(cls.unread_family(user_id))}'
+
+    @classmethod
+    def count_unread(cls, user_id):
+        return cls.objects.filter(user_id=user_id, read=False).count()
+
+    @classmethod
+    def unread_count(cls, user_id):
+        """
+        Unread notifications of a user, counted once and then kept in the
+        cache. A per-process cache can't see the other workers' updates, so
+        without a shared cache every read is counted (notification_inbox_idx).
+        """
+        if not cache_is_shared():
+            return cls.count_unread(user_id)
+        # the key is read before counting: a write committed meanwhile bumps
+        # the version, so a count that missed it is stored under a dead key
+        key = cls.unread_cache_key(user_id)
+        count = cache.get(key)
+        if count is None:
+            count = cls.count_unread(user_id)
+            cache.add(key, count, getattr(settings, 'NOTIFICATION_UNREAD_TTL', 3600))
+        return max(count, 0)
+
+    @classmethod
+    def bump_unread_version(cls, user_id):
+        key = generation_key(cls.unread_family(user_id))
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_generation(), None)
+
+    @classmethod
+    def adjust_unread(cls, user_id, delta):
+        """Move a cached unread counter once the current transaction commits"""
+        if not cache_is_shared():
+            return
+
+        def apply():
+            key = cls.unread_cache_key(user_id)
+            try:
+                if delta > 0:
+                    cache.incr(key, delta)
+                elif delta < 0:
+                    cache.decr(key, -delta)
+            except ValueError:
+                # not cached: a read counting right now may have missed this
+                # write, move it to a new key so the next read counts again
+                cls.bump_unread_version(user_id)
+        transaction.on_commit(apply)
+
+    @classmethod
+    def forget_unread(cls, user_ids):
+        """Drop cached unread counters so they are recounted on the next read"""
+        if not cache_is_shared():
+            return
+        user_ids = set(user_ids)
+
+        def apply():
+            for user_id in user_ids:
+                cls.bump_unread_version(user_id)
+        transaction.on_commit(apply)
+
+    @classmethod
+    def bulk_notify(cls, notifications, ignore_conflicts=False):
+        """
+        bulk_create notifications and keep the unread counters in step.
+        With ignore_conflicts the inserted rows aren't known, so the
+        counters of the users involved are recounted instead.
+        """
+        notifications = cls.objects.bulk_create(notifications, ignore_conflicts=ignore_conflicts)
+        events.publish(notification.user_id for notification in notifications)
+
+        if ignore_conflicts:
+            cls.forget_unread(notification.user_id for notification in notifications if not notification.read)
+        else:
+            added = {}
+            for notification in notifications:
+                if not notification.read:
+                    added[notification.user_id] = added.get(notification.user_id, 0) + 1
+            for user_id, count in added.items():
+                cls.adjust_unread(user_id, count)
+        return notifications
+
+    @classmethod
+    def mark_read(cls, user_id, notification_ids=None):
+        """Mark the given (or all) unread notifications of a user as read, returns how many changed"""
+        notifications = cls.objects.filter(user_id=user_id, read=False)
+        if notification_ids is not None:
+            notifications = notifications.filter(pk__in=notification_ids)
+
+        updated = notifications.update(read=True)
+        if notification_ids is None:
+            if cache_is_shared():
+                transaction.on_commit(lambda: cache.set(
+                    cls.unread_cache_key(user_id), 0, getattr(settings, 'NOTIFICATION_UNREAD_TTL', 3600)
+                ))
+        elif updated:
+            cls.adjust_unread(user_id, -updated)
+        return updated
+
+
+class OutboundEmail(models.Model):
+    """Transactional outbox: emails are stored with the request's data and sent by the send_outbox worker"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # when pending: earliest next try; when sending: end of the worker's lease
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at'], condition=Q(status__in=['pending', 'sending']),
+                         name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.recipients)} ({self.status})"
@@ -0,0 +1,130 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+
+def queue_email(subject, message, recipient_list, from_email=None):
+    """
+    Store an email for the send_outbox worker. The row is part of the
+    caller's transaction, so it only becomes visible (and is only sent)
+    once that transaction commits.
+    """
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=list(recipient_list),
+    )
+
+
+def queue_messages(messages):
+    """Store several EmailMessages for the send_outbox worker in one insert, see queue_email"""
+    return OutboundEmail.objects.bulk_create([
+        OutboundEmail(
+            subject=message.subject,
+            body=message.body,
+            from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+            recipients=list(message.to),
+        )
+        for message in messages
+    ])
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter"""
+    base = settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS
+    delay = min(base * 2 ** (attempts - 1), settings.EMAIL_OUTBOX_RETRY_MAX_SECONDS)
+    return timedelta(seconds=delay + random.uniform(0, base))
+
+
+def claim_batch(batch_size):
+    """
+    Lease up to batch_size due emails to this worker. Rows locked by other
+    workers are skipped; a lease that runs out (crashed worker) makes the
+    email claimable again.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status__in=['pending', 'sending'], next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        OutboundEmail.objects.filter(id__in=ids).update(
+            status='sending',
+            next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS)
+        )
+    return list(OutboundEmail.objects.filter(id__in=ids).order_by('id'))
+
+
+def send_emails(emails):
+    """Send emails over one reused connection, returns (id, error) pairs"""
+    results = []
+    connection = get_connection()
+    try:
+        connection.open()
+        for email in emails:
+            message = EmailMessage(
+                email.subject, email.body, email.from_email, email.recipients, connection=connection
+            )
+            try:
+                message.send()
+                results.append((email.id, None))
+            except Exception as e:
+                results.append((email.id, f"{type(e).__name__}: {e}"))
+    except Exception as e:
+        # the connection itself failed, everything left is retried
+        done = {email_id for email_id, _ in results}
+        results.extend((email.id, f"{type(e).__name__}: {e}") for email in emails if email.id not in done)
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return results
+
+
+def deliver_outbox(batch_size=100, workers=4):
+    """
+    Claim one batch and send it with up to `workers` SMTP connections in
+    parallel. Returns the number of emails processed.
+    """
+    emails = claim_batch(batch_size)
+    if not emails:
+        return 0
+
+    workers = max(workers, 1)
+    slices = [emails[i::workers] for i in range(workers) if emails[i::workers]]
+    with ThreadPoolExecutor(max_workers=len(slices)) as pool:
+        results = [result for batch in pool.map(send_emails, slices) for result in batch]
+
+    now = timezone.now()
+    attempts = {email.id: email.attempts + 1 for email in emails}
+
+    sent = [email_id for email_id, error in results if error is None]
+    if sent:
+        OutboundEmail.objects.filter(id__in=sent).update(
+            status='sent', sent_at=now, attempts=F('attempts') + 1, last_error=''
+        )
+
+    for email_id, error in results:
+        if error is None:
+            continue
+        failed = attempts[email_id] >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS
+        OutboundEmail.objects.filter(id=email_id).update(
+            status='failed' if failed else 'pending',
+            attempts=attempts[email_id],
+            next_attempt_at=now + retry_delay(attempts[email_id]),
+            last_error=error
+        )
+
+    return len(emails)
@@ -0,0 +1,11 @@
+from rest_framework import serializers
+from .models import Notification
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    book_title = serializers.ReadOnlyField(source='book_copy.book.title')
+
+    class Meta:
+        model = Notification
+        fields = ['id', 'message', 'notification_type', 'book_copy', 'book_title', 'due_date', 'created_at', 'read']
+        read_only_fields = fields
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import events
+from .models import Notification
+
+
+@receiver(post_save, sender=Notification)
+def notification_saved(sender, instance, created, update_fields=None, **kwargs):
+    """Announce and count a new notification, recount when read changed on an existing one"""
+    if created:
+        events.publish([instance.user_id])
+        if not instance.read:
+            Notification.adjust_unread(instance.user_id, 1)
+    elif update_fields is None or 'read' in update_fields:
+        Notification.forget_unread([instance.user_id])
+
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    if not instance.read:
+        Notification.adjust_unread(instance.user_id, -1)
@@ -1,3 +1,251 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import timedelta
+from smtplib import SMTPException
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core import mail
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users.models import User
+from .events import broker
+from .models import Notification, OutboundEmail
+from .outbox import claim_batch, deliver_outbox, queue_email
+
+
+class UnreadCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        Notification.objects.create(user=self.user, message='Dune is due', notification_type='due_soon')
+
+    def test_per_process_cache_is_not_trusted(self):
+        self.assertEqual(Notification.unread_count(self.user.pk), 1)
+        # a write this process never heard of, as if made by another worker
+        Notification.objects.filter(user=self.user).update(read=True)
+        self.assertEqual(Notification.unread_count(self.user.pk), 0)
+
+    def test_notification_committed_while_counting_is_not_lost(self):
+        count_unread = Notification.count_unread
+
+        def count_then_notify(user_id):
+            count = count_unread(user_id)
+            # committed by another request between the COUNT and the cache add
+            with self.captureOnCommitCallbacks(execute=True):
+                Notification.objects.create(user=self.user, message='Emma is due', notification_type='due_soon')
+            return count
+
+        with mock.patch('notifications.models.cache_is_shared', return_value=True):
+            with mock.patch.object(Notification, 'count_unread', count_then_notify):
+                self.assertEqual(Notification.unread_count(self.user.pk), 1)
+            self.assertEqual(Notification.unread_count(self.user.pk), 2)
+            with self.assertNumQueries(0):
+                self.assertEqual(Notification.unread_count(self.user.pk), 2)
+
+
+class InboxTests(TestCase):
+    url = '/api/v1/notifications/'
+
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.notifications = [
+            Notification.objects.create(user=self.user, message=f'Book {number} is due', notification_type='due_soon')
+            for number in range(5)
+        ]
+        other = User.objects.create(username='other', email='other@example.com')
+        self.foreign = Notification.objects.create(user=other, message='Emma is due', notification_type='due_soon')
+
+    def messages(self, url):
+        """Every message of the inbox, following the cursor from url"""
+        messages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            messages += [notification['message'] for notification in response.data['results']]
+            url = response.data['next']
+        return messages
+
+    def test_pages_are_newest_first(self):
+        self.assertEqual(self.messages(f'{self.url}?page_size=2'),
+                         [f'Book {number} is due' for number in reversed(range(5))])
+
+    def test_unread_filter(self):
+        Notification.objects.filter(pk__in=[self.notifications[1].pk, self.notifications[3].pk]).update(read=True)
+        self.assertEqual(self.messages(f'{self.url}?unread=true&page_size=2'),
+                         ['Book 4 is due', 'Book 2 is due', 'Book 0 is due'])
+
+    def test_mark_read(self):
+        response = self.client.post(f'{self.url}mark_read/',
+                                    {"ids": [self.notifications[0].pk, self.notifications[1].pk]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"updated": 2, "unread": 3})
+        self.assertEqual(self.client.get(f'{self.url}unread_count/').data, {"unread": 3})
+        # already read
+        response = self.client.post(f'{self.url}mark_read/', {"ids": [self.notifications[0].pk]}, format='json')
+        self.assertEqual(response.data, {"updated": 0, "unread": 3})
+
+    def test_mark_read_rejects_malformed_and_foreign_ids(self):
+        for ids in ([], 'all', ['one'], [self.notifications[0].pk, self.foreign.pk], [self.foreign.pk + 1000]):
+            response = self.client.post(f'{self.url}mark_read/', {"ids": ids}, format='json')
+            self.assertEqual(response.status_code, 400, ids)
+
+        self.assertEqual(Notification.objects.filter(read=True).count(), 0)
+
+    def test_mark_all_read(self):
+        self.assertEqual(self.client.get(f'{self.url}unread_count/').data, {"unread": 5})
+
+        response = self.client.post(f'{self.url}mark_all_read/')
+
+        self.assertEqual(response.data, {"updated": 5, "unread": 0})
+        self.assertEqual(self.client.get(f'{self.url}unread_count/').data, {"unread": 0})
+        self.assertEqual(self.messages(f'{self.url}?unread=true'), [])
+        self.foreign.refresh_from_db()
+        self.assertFalse(self.foreign.read)
+
+
+class NotificationStreamTests(TransactionTestCase):
+    def test_first_frame_carries_the_starting_id(self):
+        user = User.objects.create(username='reader', email='reader@example.com')
+        notification = Notification.objects.create(user=user, message='Dune is due', notification_type='due_soon')
+        token = RefreshToken.for_user(user).access_token
+
+        async def first_frame():
+            response = await self.async_client.get(f'/api/v1/notifications/stream/?token={token}')
+            content = response.streaming_content
+            try:
+                return await content.__anext__()
+            finally:
+                await content.aclose()
+
+        frame = async_to_sync(first_frame)()
+        self.assertTrue(frame.decode().startswith(f'id: {notification.pk}\n'))
+
+    @override_settings(NOTIFICATION_STREAM_HEARTBEAT=2)
+    def test_notify_wakes_an_idle_stream_that_holds_no_connection(self):
+        user = User.objects.create(username='reader', email='reader@example.com')
+        token = RefreshToken.for_user(user).access_token
+        main_thread = threading.get_ident()
+        opened = []
+
+        def track(sender, connection, **kwargs):
+            if threading.get_ident() != main_thread:
+                opened.append(connection.connection)
+        connection_created.connect(track)
+        self.addCleanup(connection_created.disconnect, track)
+
+        async def wake_up():
+            response = await self.async_client.get(f'/api/v1/notifications/stream/?token={token}')
+            content = response.streaming_content
+            try:
+                await content.__anext__()
+                # idle on its queue after the first keep-alive
+                self.assertEqual(await content.__anext__(), b': keep-alive\n\n')
+                self.assertTrue(broker.listening)
+                self.assertTrue(opened)
+                self.assertTrue(all(raw.closed for raw in opened))
+
+                await sync_to_async(Notification.objects.create)(
+                    user=user, message='Dune is due', notification_type='due_soon'
+                )
+                notified = time.monotonic()
+                frame = await content.__anext__()
+                return frame, time.monotonic() - notified
+            finally:
+                await content.aclose()
+
+        frame, delay = async_to_sync(wake_up)()
+        self.assertIn(b'event: notification', frame)
+        # woken by the NOTIFY, not by the next heartbeat
+        self.assertLess(delay, 2)
+        self.assertTrue(all(raw.closed for raw in opened))
+
+
+class OutboxTests(TestCase):
+    def queue(self, count=1, **fields):
+        emails = [queue_email('Dune is due', 'Please return it', [f'reader{number}@example.com'])
+                  for number in range(count)]
+        if fields:
+            OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(**fields)
+        return emails
+
+    def failing(self):
+        return mock.patch('django.core.mail.EmailMessage.send', side_effect=SMTPException('mailbox unavailable'))
+
+    def test_batch_is_sent(self):
+        self.queue(3)
+        self.assertEqual(deliver_outbox(workers=2), 3)
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(set(OutboundEmail.objects.values_list('status', 'attempts')), {('sent', 1)})
+        self.assertEqual(deliver_outbox(), 0)
+
+    def test_failure_is_retried_with_backoff(self):
+        email, = self.queue()
+        with self.failing():
+            started = timezone.now()
+            self.assertEqual(deliver_outbox(), 1)
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertIn('mailbox unavailable', email.last_error)
+        base = timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS)
+        self.assertTrue(started + base <= email.next_attempt_at <= timezone.now() + 2 * base)
+        # not due yet
+        self.assertEqual(deliver_outbox(), 0)
+
+        OutboundEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_outbox(), 1)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.last_error), ('sent', 2, ''))
+
+    def test_last_attempt_marks_the_email_failed(self):
+        email, = self.queue(attempts=settings.EMAIL_OUTBOX_MAX_ATTEMPTS - 1)
+        with self.failing():
+            deliver_outbox()
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', settings.EMAIL_OUTBOX_MAX_ATTEMPTS))
+        self.assertEqual(deliver_outbox(), 0)
+
+    def test_expired_lease_is_claimed_again(self):
+        leased, = self.queue(status='sending', next_attempt_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(claim_batch(10), [])
+
+        # the worker holding the lease crashed
+        OutboundEmail.objects.filter(pk=leased.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(claim_batch(10), [leased])
+
+
+class OutboxClaimTests(TransactionTestCase):
+    def test_rows_locked_by_another_worker_are_skipped(self):
+        locked, free = [queue_email('Dune is due', 'Please return it', ['reader@example.com']) for _ in range(2)]
+        is_locked = threading.Event()
+        release = threading.Event()
+
+        def other_worker():
+            try:
+                with transaction.atomic():
+                    list(OutboundEmail.objects.select_for_update().filter(pk=locked.pk))
+                    is_locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=other_worker)
+        thread.start()
+        try:
+            is_locked.wait(10)
+            self.assertEqual(claim_batch(10), [free])
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(claim_batch(10), [locked])
@@ -1,3 +1,173 @@
-from django.shortcuts import render
+import asyncio
+import functools
+import json
+import time
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework import viewsets, mixins, status
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.exceptions import AuthenticationFailed
+from users.authentication import ClaimsJWTAuthentication
+
+from .events import broker
+from .models import Notification
+from .serializers import NotificationSerializer
+
+
+class NotificationPagination(CursorPagination):
+    """Keyset pages over the user's inbox, newest first"""
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class NotificationViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    serializer_class = NotificationSerializer
+    pagination_class = NotificationPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        notifications = Notification.objects.filter(user_id=self.request.user.pk).select_related('book_copy__book')
+        if self.request.query_params.get('unread', '').lower() in ('1', 'true'):
+            notifications = notifications.filter(read=False)
+        return notifications
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        """Unread badge, served from the cached counter"""
+        return Response({"unread": Notification.unread_count(request.user.pk)})
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        """Mark the notifications listed in ids as read"""
+        notification_ids = request.data.get('ids', [])
+        if not isinstance(notification_ids, list) or not notification_ids:
+            return Response({"error": "ids must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            notification_ids = [int(notification_id) for notification_id in notification_ids]
+        except (TypeError, ValueError):
+            return Response({"error": "ids must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        unknown_ids = set(notification_ids) - set(
+            Notification.objects.filter(user_id=request.user.pk, pk__in=notification_ids).values_list('pk', flat=True)
+        )
+        if unknown_ids:
+            return Response({"error": f"Unknown notification ids: {sorted(unknown_ids)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        updated = Notification.mark_read(request.user.pk, notification_ids)
+        return Response({"updated": updated, "unread": Notification.unread_count(request.user.pk)})
+
+    @action(detail=False, methods=['post'])
+    def mark_all_read(self, request):
+        updated = Notification.mark_read(request.user.pk)
+        return Response({"updated": updated, "unread": 0})
+
+
+def released_connection(function):
+    """
+    Run function in the shared thread pool and close the database
+    connection it opened, so an idle stream holds neither a thread nor a
+    connection between its reads
+    """
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            connection.close()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+@released_connection
+def stream_user(request):
+    """JWT user from the Authorization header, or ?token= since EventSource can't set headers"""
+    authentication = ClaimsJWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else request.GET.get('token')
+    if not raw_token:
+        return None
+    return authentication.get_user(authentication.get_validated_token(raw_token))
+
+
+@released_connection
+def newest_notification_id(user_id):
+    return Notification.objects.filter(user_id=user_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+@released_connection
+def new_notifications(user_id, last_id):
+    """(id, serialized data) of the user's notifications after last_id, oldest first"""
+    notifications = Notification.objects.filter(
+        user_id=user_id, id__gt=last_id
+    ).select_related('book_copy__book').order_by('id')
+    return [
+        (notification.pk, json.dumps(NotificationSerializer(notification).data, default=str))
+        for notification in notifications
+    ]
+
+
+async def notification_stream(request):
+    """
+    Server-sent events with the user's new notifications. Needs ASGI: an
+    idle stream is a coroutine waiting on its broker queue, not a thread,
+    and its reads return their database connection when done.
+    The stream ends after NOTIFICATION_STREAM_MAX_AGE seconds and the
+    browser reconnects with Last-Event-ID, so nothing is missed.
+    """
+    try:
+        user = await stream_user(request)
+    except AuthenticationFailed:
+        return JsonResponse({"error": "Invalid or expired token"}, status=status.HTTP_401_UNAUTHORIZED)
+    if user is None:
+        return JsonResponse({"error": "Authentication credentials were not provided"},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+    except (TypeError, ValueError):
+        last_id = None
+
+    heartbeat = getattr(settings, 'NOTIFICATION_STREAM_HEARTBEAT', 15)
+    max_age = getattr(settings, 'NOTIFICATION_STREAM_MAX_AGE', 300)
+
+    async def events():
+        nonlocal last_id
+        queue = broker.subscribe(user.pk)
+        try:
+            if last_id is None:
+                last_id = await newest_notification_id(user.pk)
+            # the id is kept by the browser even without data, so a stream that
+            # ends before any event still reconnects from this point
+            yield f"id: {last_id}\nretry: {heartbeat * 1000}\n\n"
+
+            deadline = time.monotonic() + max_age
+            check = True
+            while time.monotonic() < deadline:
+                if check:
+                    for notification_id, data in await new_notifications(user.pk, last_id):
+                        last_id = notification_id
+                        yield f"id: {notification_id}\nevent: notification\ndata: {data}\n\n"
+
+                try:
+                    await asyncio.wait_for(queue.get(), heartbeat)
+                    check = True
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    # without a listener, fall back to polling on the heartbeat
+                    check = not broker.listening
+        finally:
+            broker.unsubscribe(user.pk, queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,214 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser as BaseTokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User, RevokedToken, TokenRevocation
+
+
+class UserCache:
+    """Short-lived in-process LRU of full User rows, for the views that need more than the claims"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        # keyed by str, the user_id claim is a string in recent simplejwt versions
+        user_id = str(user_id)
+        ttl = getattr(settings, 'AUTH_USER_CACHE_TTL', 30)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(user_id)
+                return entry[1]
+
+        user = User.objects.filter(pk=user_id).first()
+        with self.lock:
+            self.entries[user_id] = (now + ttl, user)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return user
+
+    def forget(self, user_id):
+        with self.lock:
+            self.entries.pop(str(user_id), None)
+
+
+user_cache = UserCache()
+
+
+class TokenUser(BaseTokenUser):
+    """
+    request.user built from the signed user_id, role and is_staff claims
+    added at login, without a query. Anything else is read from the full
+    User, loaded once through user_cache.
+    """
+
+    @cached_property
+    def user(self):
+        return user_cache.get(self.id)
+
+    @cached_property
+    def role(self):
+        if 'role' in self.token:
+            return self.token['role']
+        # issued before the claim existed
+        return self.user.role if self.user else None
+
+    @cached_property
+    def is_staff(self):
+        if 'is_staff' in self.token:
+            return self.token['is_staff']
+        return self.user.is_staff if self.user else False
+
+    @cached_property
+    def username(self):
+        if 'username' in self.token:
+            return self.token['username']
+        return self.user.username if self.user else ''
+
+    def is_admin(self):
+        return self.role == 'admin'
+
+    def is_user(self):
+        return self.role == 'user'
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if attr in self.token:
+            return self.token[attr]
+        if self.user is None:
+            raise AttributeError(attr)
+        return getattr(self.user, attr)
+
+
+class RevocationList:
+    """
+    In-process copy of the live revocations: the revoked jtis and every
+    user's revoked_before timestamp. It is reloaded from RevokedToken and
+    TokenRevocation at most every AUTH_REVOCATION_REFRESH seconds, so a
+    revocation made by another worker is honoured here within that time;
+    revocations made in this process apply as soon as they commit.
+    """
+
+    def __init__(self):
+        self.jtis = set()
+        self.revoked_before = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Reload when the copy is older than AUTH_REVOCATION_REFRESH, other threads keep the old one meanwhile"""
+        interval = getattr(settings, 'AUTH_REVOCATION_REFRESH', 30)
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at < interval:
+            return
+        if not self.lock.acquire(blocking=self.loaded_at is None):
+            return
+        try:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at >= interval:
+                self.load()
+        finally:
+            self.lock.release()
+
+    def load(self):
+        loaded_at = time.monotonic()
+        now = timezone.now()
+        jtis = set(RevokedToken.objects.filter(expires_at__gt=now).values_list('jti', flat=True))
+        # older revocations only cover tokens that have expired by now
+        since = now - api_settings.REFRESH_TOKEN_LIFETIME
+        # keyed by str, the user_id claim is a string in recent simplejwt versions
+        revoked_before = {
+            str(user_id): moment.timestamp()
+            for user_id, moment in TokenRevocation.objects.filter(revoked_before__gt=since).values_list(
+                'user_id', 'revoked_before'
+            )
+        }
+        self.jtis, self.revoked_before, self.loaded_at = jtis, revoked_before, loaded_at
+
+    # under the lock, so a reload that read the tables before the commit can't drop them
+    def add_jti(self, jti):
+        with self.lock:
+            self.jtis = self.jtis | {jti}
+
+    def add_user(self, user_id, revoked_before):
+        with self.lock:
+            self.revoked_before = {**self.revoked_before, str(user_id): revoked_before}
+
+    def reset(self):
+        with self.lock:
+            self.jtis, self.revoked_before, self.loaded_at = set(), {}, None
+
+
+revocations = RevocationList()
+
+
+def revoke_token(token):
+    """Reject this token until it expires"""
+    remaining = int(token['exp'] - time.time())
+    if remaining <= 0:
+        return
+    now = timezone.now()
+    # tokens past their expiry are rejected anyway
+    RevokedToken.objects.filter(expires_at__lte=now).delete()
+    RevokedToken.objects.bulk_create(
+        [RevokedToken(jti=token['jti'], expires_at=now + timedelta(seconds=remaining))],
+        ignore_conflicts=True
+    )
+    jti = token['jti']
+    transaction.on_commit(lambda: revocations.add_jti(jti))
+
+
+def revoke_user_tokens(user_id):
+    """Reject every token of the user issued up to now, e.g. after a password change"""
+    now = timezone.now()
+    TokenRevocation.objects.update_or_create(user_id=user_id, defaults={'revoked_before': now})
+    transaction.on_commit(lambda: revocations.add_user(user_id, now.timestamp()))
+
+
+def issued_before(token, revoked_before):
+    if 'issued_at' in token:
+        # sub-second issue time set at login, a login right after a revocation is kept
+        return token['issued_at'] < revoked_before
+    # iat has whole seconds only, the second of the revocation counts as before it
+    return token.get('iat', 0) <= int(revoked_before)
+
+
+def is_revoked(token):
+    """
+    Whether the token's jti or every token of its user was revoked,
+    answered from the in-process RevocationList without a query. Deleting
+    a user revokes their tokens too.
+    """
+    revocations.refresh()
+    if token['jti'] in revocations.jtis:
+        return True
+    revoked_before = revocations.revoked_before.get(str(token.get(api_settings.USER_ID_CLAIM)))
+    return revoked_before is not None and issued_before(token, revoked_before)
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    Bearer JWT authentication that trusts the token's claims instead of
+    loading the user row, and rejects tokens revoked at logout or by a
+    password reset.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_revoked(token):
+            raise InvalidToken({"detail": "Token has been revoked", "code": "token_revoked"})
+        return token
@@ -0,0 +1,96 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from users.hashers import TunedArgon2PasswordHasher, TunedBCryptSHA256PasswordHasher, TunedPBKDF2PasswordHasher
+
+HASHERS = {
+    'argon2': TunedArgon2PasswordHasher,
+    'bcrypt': TunedBCryptSHA256PasswordHasher,
+    'pbkdf2': TunedPBKDF2PasswordHasher,
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure password verifications (logins) per second per core for each hasher and cost'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hasher',
+            action='append',
+            choices=sorted(HASHERS),
+            help='Hasher to measure, repeatable (default: all installed)',
+        )
+        parser.add_argument(
+            '--seconds',
+            type=float,
+            default=3,
+            help='Duration of each measurement',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Parallel verifications for the multi-core measurement',
+        )
+        parser.add_argument('--pbkdf2-iterations', type=int)
+        parser.add_argument('--argon2-time-cost', type=int)
+        parser.add_argument('--argon2-memory-cost', type=int)
+        parser.add_argument('--argon2-parallelism', type=int)
+        parser.add_argument('--bcrypt-rounds', type=int)
+
+    def handle(self, *args, **options):
+        costs = {
+            'pbkdf2': {'iterations': options['pbkdf2_iterations']},
+            'argon2': {
+                'time_cost': options['argon2_time_cost'],
+                'memory_cost': options['argon2_memory_cost'],
+                'parallelism': options['argon2_parallelism'],
+            },
+            'bcrypt': {'rounds': options['bcrypt_rounds']},
+        }
+        threads = max(options['threads'], 1)
+        cores = min(threads, os.cpu_count() or 1)
+
+        for name in options['hasher'] or sorted(HASHERS):
+            hasher = HASHERS[name]()
+            for attribute, value in costs[name].items():
+                if value is not None:
+                    setattr(hasher, attribute, value)
+
+            try:
+                encoded = hasher.encode('benchmark-password', hasher.salt())
+            except ValueError as e:
+                self.stdout.write(self.style.WARNING(f'{name}: skipped, {e}'))
+                continue
+
+            single = self.measure(hasher, encoded, options['seconds'], 1)
+            parallel = self.measure(hasher, encoded, options['seconds'], threads)
+            cost = ', '.join(f'{attribute}={getattr(hasher, attribute)}' for attribute in costs[name])
+
+            self.stdout.write(
+                f'{name} ({cost}): {1000 / single:.1f} ms per login, '
+                f'{single:.1f} logins/s on one thread, '
+                f'{parallel:.1f} logins/s on {threads} threads, '
+                f'{parallel / cores:.1f} logins/s per core'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Successfully ran the login benchmark'))
+
+    @staticmethod
+    def measure(hasher, encoded, seconds, threads):
+        """Verifications per second over `threads` threads"""
+        deadline = time.perf_counter() + seconds
+
+        def run():
+            count = 0
+            while time.perf_counter() < deadline:
+                hasher.verify('benchmark-password', encoded)
+                count += 1
+            return count
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            total = sum(executor.map(lambda _: run(), range(threads)))
+        return total / (time.perf_counter() - started)
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.20 on 2026-10-18 21:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_token_revocation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tokenrevocation',
+            name='user',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='token_revocation', serialize=False, to='users.user'),
+        ),
+    ]
@@ -33,3 +33,25 @@ class User(AbstractUser):
     def is_user(self):
         return self.role == 'user'
 
+
+
+class RevokedToken(models.Model):
+    """A token revoked at logout, rejected until it expires"""
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.jti
+
+
+class TokenRevocation(models.Model):
+    """
+    Every token of the user issued up to revoked_before is rejected. Kept
+    when the user is deleted, deleting a user revokes their tokens.
+    """
+    user = models.OneToOneField(User, primary_key=True, on_delete=models.DO_NOTHING, db_constraint=False,
+                                related_name='token_revocation')
+    revoked_before = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user_id} before {self.revoked_before}"
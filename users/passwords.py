@@ -0,0 +1,67 @@
+"""
+Password verification, off the event loop for async views.
+
+The key derivation in hashlib, argon2-cffi and bcrypt releases the GIL,
+so under ASGI a bounded thread pool runs PASSWORD_HASH_WORKERS
+verifications in parallel and queues the rest, while the event loop and
+the thread that runs the sync views carry on. Sync views verify inline:
+their worker would only wait for the pool.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The shared pool, created by the first caller; None when PASSWORD_HASH_WORKERS is 0"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            # concurrent first logins must not each start a pool
+            if _executor is None:
+                workers = getattr(settings, 'PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+                if workers:
+                    _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+    return _executor
+
+
+def check(raw_password, encoded):
+    """(is_correct, new hash or None): a new hash when the stored one uses an outdated hasher or cost"""
+    upgraded = []
+    is_correct = check_password(raw_password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return is_correct, upgraded[0] if upgraded else None
+
+
+def save_upgrade(user, encoded):
+    # same as AbstractBaseUser.check_password's setter, minus the hashing
+    user.password = encoded
+    user.save(update_fields=['password'])
+
+
+def verify_password(user, raw_password):
+    """user.check_password, saving a rehash with the current hasher or cost"""
+    is_correct, upgraded = check(raw_password, user.password)
+    if is_correct and upgraded:
+        save_upgrade(user, upgraded)
+    return is_correct
+
+
+async def averify_password(user, raw_password):
+    """verify_password for async views, the hashing done in the pool"""
+    executor = get_executor()
+    if executor is None:
+        is_correct, upgraded = await sync_to_async(check, thread_sensitive=False)(raw_password, user.password)
+    else:
+        is_correct, upgraded = await asyncio.wrap_future(executor.submit(check, raw_password, user.password))
+
+    if is_correct and upgraded:
+        await sync_to_async(save_upgrade)(user, upgraded)
+    return is_correct
@@ -4,17 +4,19 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.core.mail import send_mail, EmailMessage, get_connection
+from django.core.mail import EmailMessage, get_connection
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
-from django.core.mail import send_mail
 from django.utils.http import urlsafe_base64_decode
 from django.contrib.auth.tokens import default_token_generator
 from django.conf import settings
+from notifications.outbox import queue_email
+from .authentication import revoke_user_tokens
+from .passwords import verify_password
 import os
 
 
@@ -47,6 +49,17 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
+def issue_tokens(user):
+    """(access, refresh) token strings for a user who just logged in"""
+    refresh = RefreshToken.for_user(user)
+    # signed claims read by users.authentication.TokenUser
+    refresh['role'] = user.role
+    refresh['is_staff'] = user.is_staff
+    # finer than iat, see users.authentication.issued_before
+    refresh['issued_at'] = refresh.current_time.timestamp()
+    return str(refresh.access_token), str(refresh)
+
+
 class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField(required=True)
     password = serializers.CharField(
@@ -64,15 +77,15 @@ class LoginSerializer(serializers.Serializer):
         if email and password:
             try:
                 user = User.objects.get(email=email)
-                if not user.check_password(password):
+                if not verify_password(user, password):
                     raise serializers.ValidationError("Invalid email or password")
 
-                refresh = RefreshToken.for_user(user)
+                access_token, refresh_token = issue_tokens(user)
 
                 return {
                     'email': user.email,
-                    'access_token': str(refresh.access_token),
-                    'refresh_token': str(refresh),
+                    'access_token': access_token,
+                    'refresh_token': refresh_token,
                     'user': user
                 }
             except User.DoesNotExist:
@@ -101,12 +114,11 @@ class ResetPasswordSerializer(serializers.Serializer):
             subject = 'Password Reset Request'
             message = f'Hello {user.username},\n\nTo reset your password, click the link below:\n{reset_url}\n\nThank you!'
 
-            send_mail(
+            queue_email(
                 subject=subject,
                 message=message,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[user.email],
-                fail_silently=False,
             )
 
         return {'message': 'Password reset link has been sent'}
@@ -137,6 +149,7 @@ class PasswordResetConfirmSerializer(serializers.Serializer):
     def save(self):
         self.user.set_password(self.validated_data['new_password'])
         self.user.save()
+        revoke_user_tokens(self.user.pk)
         return self.user
 
 
@@ -0,0 +1,39 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .authentication import user_cache, revoke_user_tokens
+from .models import User
+
+# User fields copied into the token claims at login, and is_active, which
+# ClaimsJWTAuthentication can't check without loading the user
+CLAIM_FIELDS = ('role', 'is_staff', 'is_active')
+
+
+@receiver(pre_save, sender=User)
+def remember_claims(sender, instance, update_fields=None, **kwargs):
+    """Keep the stored claim fields to compare after the save"""
+    instance._previous_claims = None
+    if instance.pk is None or (update_fields is not None and not set(update_fields) & set(CLAIM_FIELDS)):
+        return
+    instance._previous_claims = User.objects.filter(pk=instance.pk).values_list(*CLAIM_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """Other workers pick the change up when their entry expires"""
+    user_cache.forget(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def claims_changed(sender, instance, **kwargs):
+    """Tokens carrying an old role or is_staff, or of a deactivated user, are revoked"""
+    previous = getattr(instance, '_previous_claims', None)
+    if previous is not None and previous != tuple(getattr(instance, field) for field in CLAIM_FIELDS):
+        revoke_user_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """Tokens outlive their user, reject them"""
+    revoke_user_tokens(instance.pk)
@@ -1,3 +1,153 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import passwords
+from .authentication import ClaimsJWTAuthentication, is_revoked, revoke_token, revoke_user_tokens, revocations
+from .models import User, RevokedToken
+from .serializers import issue_tokens
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        self.client = APIClient()
+        revocations.reset()
+        self.addCleanup(revocations.reset)
+
+    def get_token(self):
+        access_token, _ = issue_tokens(self.user)
+        return AccessToken(access_token)
+
+    def test_revoked_token_is_rejected(self):
+        token = self.get_token()
+        self.assertFalse(is_revoked(token))
+        with self.captureOnCommitCallbacks(execute=True):
+            revoke_token(token)
+        self.assertTrue(is_revoked(token))
+        self.assertFalse(is_revoked(self.get_token()))
+
+    def test_role_change_revokes_tokens(self):
+        token = self.get_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.role = 'admin'
+            self.user.save()
+        self.assertTrue(is_revoked(token))
+
+    def test_deactivation_revokes_tokens(self):
+        token = self.get_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save(update_fields=['is_active'])
+        self.assertTrue(is_revoked(token))
+
+    def test_login_right_after_a_revocation_is_kept(self):
+        before = self.get_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            revoke_user_tokens(self.user.pk)
+        after = self.get_token()
+        # usually within the same second, told apart by issued_at
+        self.assertTrue(is_revoked(before))
+        self.assertFalse(is_revoked(after))
+
+    def test_authentication_runs_no_query(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.get_token()}')
+        self.client.get('/api/v1/notifications/unread_count/')
+        # only the count itself, the revocations were loaded by the first request
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/notifications/unread_count/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_tokens_of_deleted_users_are_revoked(self):
+        token = self.get_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertTrue(is_revoked(token))
+        # and by every other worker on its next reload
+        revocations.reset()
+        self.assertTrue(is_revoked(token))
+
+    def test_other_changes_keep_tokens(self):
+        token = self.get_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Ada'
+            self.user.save()
+            self.user.save(update_fields=['last_login'])
+        self.assertFalse(is_revoked(token))
+
+    def test_revoked_token_is_refused_by_the_api(self):
+        token = self.get_token()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            revoke_token(token)
+        response = self.client.get('/api/v1/borrowing/borrowings/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_other_workers_revocations_apply_on_reload(self):
+        token = self.get_token()
+        self.assertFalse(is_revoked(token))
+        # written by another worker, this process hasn't heard of it
+        RevokedToken.objects.create(jti=token['jti'], expires_at=timezone.now() + timedelta(hours=1))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_revoked(token))
+        with override_settings(AUTH_REVOCATION_REFRESH=0):
+            self.assertTrue(is_revoked(token))
+
+
+class TokenUserTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com', first_name='Ada')
+        self.access_token, _ = issue_tokens(self.user)
+
+    def request_user(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        user, _ = ClaimsJWTAuthentication().authenticate(request)
+        return user
+
+    def test_saved_change_is_seen_by_the_next_request(self):
+        self.assertEqual(self.request_user().first_name, 'Ada')
+        self.user.first_name = 'Grace'
+        self.user.save()
+        self.assertEqual(self.request_user().first_name, 'Grace')
+
+
+class PasswordExecutorTests(TestCase):
+    def test_concurrent_first_calls_share_one_pool(self):
+        with mock.patch.object(passwords, '_executor', None):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                executors = set(pool.map(lambda _: passwords.get_executor(), range(32)))
+            self.assertEqual(len(executors), 1)
+            executors.pop().shutdown()
+
+
+class AsyncLoginTests(TransactionTestCase):
+    url = '/api/v1/auth/login/async/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', email='reader@example.com', password='s3cret-pass')
+
+    def login(self, password):
+        async def post():
+            return await self.async_client.post(
+                self.url, {"email": "reader@example.com", "password": password}, content_type='application/json'
+            )
+        return async_to_sync(post)()
+
+    def test_login_issues_a_usable_token(self):
+        response = self.login('s3cret-pass')
+        self.assertEqual(response.status_code, 200)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.json()["access_token"]}')
+        self.assertEqual(client.get('/api/v1/notifications/unread_count/').status_code, 200)
+
+    def test_wrong_password_is_refused(self):
+        response = self.login('wrong')
+        self.assertEqual(response.status_code, 400)
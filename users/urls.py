@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RegisterViewSet, LoginViewSet, LogoutViewSet, PasswordResetViewSet, PasswordResetConfirmViewSet
+from .views import async_login, RegisterViewSet, LoginViewSet, LogoutViewSet, PasswordResetViewSet, PasswordResetConfirmViewSet
 
 router = DefaultRouter()
 router.register(r'register', RegisterViewSet, basename='register')
@@ -10,5 +10,6 @@ router.register(r'password-reset', PasswordResetViewSet, basename='password-rese
 router.register(r'password-reset-confirm', PasswordResetConfirmViewSet, basename='password-reset-confirm')
 
 urlpatterns = [
+    path('login/async/', async_login, name='async-login'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,15 +1,24 @@
+import json
+
 from rest_framework import status, viewsets
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from django.http import HttpResponseNotAllowed, JsonResponse
 from django.utils.encoding import force_str
 from django.utils.http import urlsafe_base64_decode
 from django.contrib.auth.tokens import default_token_generator
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import revoke_token
+from .passwords import averify_password
 
 from .models import User
 from .serializers import (
+    issue_tokens,
     RegisterSerializer,
     LoginSerializer,
     ResetPasswordSerializer,
@@ -43,23 +52,50 @@ class LoginViewSet(viewsets.ViewSet):
         user = validated_data['user']
 
         response = Response(status=status.HTTP_200_OK)
+        set_token_cookies(response, validated_data['access_token'], validated_data['refresh_token'])
+        response.data = {"message": "Login successful", "user": user.id, "access_token": validated_data['access_token']}
+
+        return response
+
+
+def set_token_cookies(response, access_token, refresh_token):
+    for key, value in (('access_token', access_token), ('refresh_token', refresh_token)):
         response.set_cookie(
-            key='access_token',
-            value=validated_data['access_token'],
-            httponly=True,
-            secure=True,
-            samesite=None,
-        )
-        response.set_cookie(
-            key='refresh_token',
-            value=validated_data['refresh_token'],
+            key=key,
+            value=value,
             httponly=True,
             secure=True,
             samesite=None,
         )
-        response.data = {"message": "Login successful", "user": user.id, "access_token": validated_data['access_token']}
 
-        return response
+
+async def async_login(request):
+    """
+    The login endpoint for ASGI deployments: the password hash is verified
+    in the users.passwords pool while the event loop and the sync views
+    keep running. Takes a JSON body with email and password.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    try:
+        data = json.loads(request.body)
+        email, password = data['email'], data['password']
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({"error": "Must include 'email' and 'password'"}, status=status.HTTP_400_BAD_REQUEST)
+
+    user = await User.objects.filter(email=email).afirst() if isinstance(email, str) else None
+    if user is None or not isinstance(password, str) or not await averify_password(user, password):
+        return JsonResponse({"error": "Invalid email or password"}, status=status.HTTP_400_BAD_REQUEST)
+
+    access_token, refresh_token = issue_tokens(user)
+    response = JsonResponse({"message": "Login successful", "user": user.id, "access_token": access_token})
+    set_token_cookies(response, access_token, refresh_token)
+    return response
+
+
+# token login like the DRF views, no session to protect; csrf_exempt() only wraps sync views in Django 4.2
+async_login.csrf_exempt = True
 
 
 class LogoutViewSet(viewsets.ViewSet):
@@ -67,6 +103,15 @@ class LogoutViewSet(viewsets.ViewSet):
 
     @action(methods=['post'], detail=False)
     def logout(self, request):
+        # Revoke the access token and, when we get it, the refresh token
+        revoke_token(request.auth)
+        raw_refresh = request.data.get('refresh') or request.COOKIES.get('refresh_token')
+        if raw_refresh:
+            try:
+                revoke_token(RefreshToken(raw_refresh))
+            except TokenError:
+                pass
+
         # Delete the tokens from cookies
         response = Response({
             "message": "Logged out successfully"